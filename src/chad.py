@@ -5,32 +5,72 @@
 import os
 import sys
 import datetime
+import time
 import warnings
 import re
-
-import requests
-from bs4 import BeautifulSoup
+import json
+import functools
+import itertools
+import glob
+import io
+import shutil
+import bisect
+import threading
+import uuid
+import hashlib
+import cProfile
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import importlib
+from html import unescape
 
 import typer
 from typing import List
 from typing_extensions import Annotated
 
-from chat_downloader import ChatDownloader
-
-import dash
-from dash import Dash, html, dcc, Input, Output, dash_table, State
-import plotly.express as px
-import plotly.graph_objects as go
-
-
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pandas.errors import SettingWithCopyWarning
 
 import webbrowser
 
+try:
+    import fcntl                    # file locks between processes, not on windows
+except ImportError:
+    fcntl = None
+
+class LazyModule:
+    # module imported the first time one of its attributes is used,
+    # dash, plotly, requests and chat_downloader take most of the startup time and only some commands need them
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
 
-from tabulate import tabulate
+requests = LazyModule("requests")
+chat_downloader = LazyModule("chat_downloader")
+tabulate_module = LazyModule("tabulate")
+flask = LazyModule("flask")
+dash = LazyModule("dash")
+html = LazyModule("dash.html")
+dcc = LazyModule("dash.dcc")
+dash_table = LazyModule("dash.dash_table")
+go = LazyModule("plotly.graph_objects")
+
+def ChatDownloader():
+    return chat_downloader.ChatDownloader()
+
+def tabulate(*args, **kwargs):
+    return tabulate_module.tabulate(*args, **kwargs)
 
 # ------------------------  ------------------------  ------------------------
 # ------------ ------------------------  ------------------------ ------------
@@ -55,7 +95,69 @@ warnings.simplefilter(action="ignore", category=SettingWithCopyWarning)
 
 app = typer.Typer(add_completion=False, pretty_exceptions_enable=False, help=__SOFT_BRIEF__)
 
-dasher = dash.Dash(__name__)
+# the Dash app is only built by serve, callbacks and server hooks are recorded at import and added by dashboard()
+DASH_CALLBACKS = []
+DASH_SERVER_HOOKS = []
+dasher = None
+
+class DashDependency:
+    # Input/Output/State of a recorded callback, made into a dash dependency when the app is built
+
+    def __init__(self, kind: str, *args, **kwargs):
+        self.kind = kind
+        self.args = args
+        self.kwargs = kwargs
+
+    def resolve(self):
+        return getattr(dash, self.kind)(*self.args, **self.kwargs)
+
+def Input(*args, **kwargs):
+    return DashDependency('Input', *args, **kwargs)
+
+def Output(*args, **kwargs):
+    return DashDependency('Output', *args, **kwargs)
+
+def State(*args, **kwargs):
+    return DashDependency('State', *args, **kwargs)
+
+def resolveDependencies(spec):
+    if isinstance(spec, (list, tuple)):
+        return [resolveDependencies(s) for s in spec]
+    return spec.resolve() if isinstance(spec, DashDependency) else spec
+
+def callback(*args, **kwargs):
+    # same arguments as dasher.callback
+    def decorator(fn):
+        DASH_CALLBACKS.append((args, kwargs, fn))
+        return fn
+    return decorator
+
+def clientsideCallback(code: str, *args, **kwargs):
+    # same arguments as dasher.clientside_callback, code is the javascript function
+    DASH_CALLBACKS.append((args, kwargs, code))
+
+def serverHook(kind: str, *args):
+    # a flask decorator of dasher.server, e.g. serverHook('route', '/metrics')
+    def decorator(fn):
+        DASH_SERVER_HOOKS.append((kind, args, fn))
+        return fn
+    return decorator
+
+def dashboard():
+    global dasher
+    if dasher is None:
+        dasher = dash.Dash(__name__)
+        for kind, args, fn in DASH_SERVER_HOOKS:
+            hook = getattr(dasher.server, kind)
+            if args:
+                hook = hook(*args)
+            hook(fn)
+        for args, kwargs, fn in DASH_CALLBACKS:
+            if isinstance(fn, str):
+                dasher.clientside_callback(fn, *resolveDependencies(args), **kwargs)
+            else:
+                dasher.callback(*resolveDependencies(args), **kwargs)(fn)
+    return dasher
 
 # ------------------------  ------------------------  ------------------------
 # ------------ ------------------------  ------------------------ ------------
@@ -69,36 +171,392 @@ def time_formatMin(x, pos):
 def time_formatSec(x, pos):
     return str(datetime.timedelta(seconds=x)).split(".")[0]
 
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Instrumentation, callback and stage timings served on /metrics
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PROFILE_DIR = os.environ.get("CHAD_PROFILE_DIR")   # dump a cProfile of every callback request there
+PROFILE_CALLBACKS = set()                          # only these callbacks when not empty
+
+class Metrics:
+    # counters in the Prometheus text format, every value is keyed by (metric, label value)
+    #   chad_callback_seconds         histogram of the whole callback request, json serialisation included
+    #   chad_callback_response_bytes  size of the callback responses sent to the browser
+    #   chad_stage_seconds            time in the instrumented functions, callbacks included, labelled with the
+    #                                 callback running them, so the serialisation of a callback is its request
+    #                                 time minus its stage time
+    # a label value is a string, or a tuple of strings for a metric with several labels
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.sums = {}
+        self.counts = {}
+
+    def observe(self, metric: str, label: str, value: float, buckets=None):
+        with self.lock:
+            key = (metric, label)
+            self.sums[key] = self.sums.get(key, 0.0) + value
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if buckets is not None:
+                counts = self.histograms.setdefault(key, [0] * len(buckets))
+                for i, le in enumerate(buckets):
+                    if value <= le:
+                        counts[i] += 1
+
+    def count(self, metric: str, label: str):
+        with self.lock:
+            key = (metric, label)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def render(self, gauges=()):
+        # gauges are (metric, help, value) computed at scrape time
+        helps = {
+            'chad_callback_seconds': ('histogram', 'callback', "Dash callback requests, serialisation included"),
+            'chad_callback_response_bytes': ('summary', 'callback', "Size of the Dash callback responses"),
+            'chad_callback_errors_total': ('counter', 'callback', "Dash callback requests that failed"),
+            'chad_stage_seconds': ('summary', ('stage', 'callback'), "Time spent in the instrumented functions"),
+            'chad_query_cache_hits_total': ('counter', 'kind', "Query results served from the query cache"),
+            'chad_query_cache_misses_total': ('counter', 'kind', "Query results computed and added to the query cache"),
+        }
+        lines = []
+        with self.lock:
+            for metric, (kind, label_name, text) in helps.items():
+                keys = sorted(k for k in self.counts if k[0] == metric)
+                if not keys:
+                    continue
+                lines.append("# HELP " + metric + " " + text)
+                lines.append("# TYPE " + metric + " " + kind)
+                names = label_name if isinstance(label_name, tuple) else (label_name,)
+                for key in keys:
+                    values = key[1] if isinstance(key[1], tuple) else (key[1],)
+                    label = ",".join(name + '="' + value + '"' for name, value in zip(names, values))
+                    if kind == 'counter':
+                        lines.append(metric + "{" + label + "} " + str(self.counts[key]))
+                        continue
+                    if kind == 'histogram':
+                        for le, n in zip(METRICS_BUCKETS, self.histograms[key]):
+                            lines.append(metric + "_bucket{" + label + ',le="' + str(le) + '"} ' + str(n))
+                        lines.append(metric + "_bucket{" + label + ',le="+Inf"} ' + str(self.counts[key]))
+                    lines.append(metric + "_sum{" + label + "} " + repr(self.sums[key]))
+                    lines.append(metric + "_count{" + label + "} " + str(self.counts[key]))
+        for metric, text, value in gauges:
+            lines.append("# HELP " + metric + " " + text)
+            lines.append("# TYPE " + metric + " gauge")
+            lines.append(metric + " " + str(value))
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def stageCallback():
+    # callback of the request running a stage, set by metrics_before_request,
+    # none outside the callback requests (cli commands, fetch and live threads)
+    if flask._module is None or not flask.has_request_context():
+        return 'none'
+    return flask.g.get('chad_callback', 'none')
+
+def timedStage(fn):
+    # record the time spent in fn as chad_stage_seconds{stage=function name,callback=callback running it}
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            METRICS.observe('chad_stage_seconds', (fn.__qualname__, stageCallback()), time.perf_counter() - t0)
+    return wrapper
+
 # ------------------------  ------------------------  ------------------------
 # ------------ ------------------------  ------------------------ ------------
 # Generic functions used to load/save data
 # ------------ ------------------------  ------------------------ ------------
 # ------------------------  ------------------------  ------------------------
-def loadChat_fromURL(url: str):
-    chat = ChatDownloader().get_chat(url)
+CHAT_BATCH_SIZE = 65536
+
+class ChatColumns:
+    # column buffers used while ingesting a chat, messages are written in preallocated
+    # typed arrays and flushed to a list of chunks every batch_size messages,
+    # the DataFrame is only built once at the end
+
+    def __init__(self, batch_size: int = CHAT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.chunks = []
+        self.count = 0
+        self.pos = 0
+        self.timestamp = np.empty(batch_size, dtype=np.int64)  # UNIX microseconds
+        self.user = np.empty(batch_size, dtype=object)
+        self.message = np.empty(batch_size, dtype=object)
+
+    def append(self, timestamp: int, user: str, message: str):
+        i = self.pos
+        self.timestamp[i] = timestamp
+        self.user[i] = user
+        self.message[i] = message
+        self.pos = i + 1
+        self.count += 1
+        if self.pos == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pos == 0:
+            return
+        n = self.pos
+        self.chunks.append((self.timestamp[:n].copy(), self.user[:n].copy(), self.message[:n].copy()))
+        self.pos = 0
+
+    def arrays(self):
+        # (timestamp, user, message) arrays of everything appended
+        self.flush()
+        if len(self.chunks) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0, dtype=object)
+        return tuple(np.concatenate([c[i] for c in self.chunks]) for i in range(3))
+
+    def drain(self):
+        # arrays of the messages appended since the last drain, they are not kept
+        arrays = self.arrays()
+        self.chunks = []
+        return arrays
+
+    def to_dataframe(self):
+        return chatFrame(*self.arrays())
+
+def chatFrame(timestamp, user, message, origin: int = None):
+    # chat DataFrame from the UNIX microseconds, author and text arrays of its messages
+    # offsets are from the first message, or from origin (UNIX microseconds) when the start of the chat is missing
+    if len(timestamp) == 0:
+        return compactChat(pd.DataFrame({'time': np.empty(0, dtype=np.int64), 'timestamp': np.empty(0, dtype=np.int64),
+                                         'user': np.empty(0, dtype=object), 'message': np.empty(0, dtype=object)}))
+
+    # offset in whole seconds from the first message, and the minute it belongs to
+    seconds = np.abs(timestamp // 1000000 - (timestamp[0] if origin is None else origin) // 1000000)
+    df = compactChat(pd.DataFrame({'time': seconds // 60, 'timestamp': seconds, 'user': user, 'message': message}))
+
+    # keep the chat sorted by time, messages can arrive slightly out of order
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values('timestamp', kind='stable', ignore_index=True)
+    return df
+
+CHAT_MESSAGE_DTYPE = pd.StringDtype("pyarrow")
+
+def compactChat(df):
+    # compact columns for a chat, ~20 bytes per message plus its utf-8 text (target: under 50 MB per million
+    # messages, python object columns take ~150-250 MB)
+    #   time, timestamp     int32 minutes/seconds from the start
+    #   user                categorical, every distinct name is stored once and rows hold an int code
+    #   message             arrow string array, one contiguous utf-8 buffer and an offsets array
+    # .str filters on user then only run once per distinct user
+    attrs = dict(df.attrs)
+    columns = {}
+    for column in ('time', 'timestamp'):
+        if column in df and df[column].dtype != np.int32:
+            columns[column] = df[column].to_numpy().astype(np.int32)
+    if 'user' in df and not isinstance(df['user'].dtype, pd.CategoricalDtype):
+        columns['user'] = pd.Categorical(df['user'].to_numpy())
+    if 'message' in df and df['message'].dtype != CHAT_MESSAGE_DTYPE:
+        columns['message'] = pd.array(df['message'].to_numpy(), dtype=CHAT_MESSAGE_DTYPE)
+    if columns:
+        df = df.assign(**columns)
+        df.attrs.update(attrs)
+    return df
+
+PROGRESS_EVERY = 1000
+
+class FetchCancelled(Exception):
+    pass
+
+@timedStage
+def ingestChat(chat, batch_size: int = CHAT_BATCH_SIZE, progress=None):
+    # consume a chat_downloader message generator into a DataFrame
+    # progress(messages, stream seconds, duration) is called every PROGRESS_EVERY messages,
+    # returning False stops the download with FetchCancelled
+    columns = ChatColumns(batch_size)
+    append = columns.append
+    duration = getattr(chat, 'duration', None)
+    next_progress = PROGRESS_EVERY
+    message_seconds = None
 
-    df = pd.DataFrame(columns=['time', 'timestamp', 'user', 'message'])
-    starttime = 0
-    started = False
+    t0 = time.perf_counter()
     for message in chat:
         message_seconds = message.get("time_in_seconds")
-        if (message_seconds < 0):
+        if message_seconds is not None and message_seconds < 0:
             continue
-        if started == False:
-            starttime = datetime.datetime.fromtimestamp(message.get("timestamp") / 1000 / 1000)
-            started = True
-
-        user = message.get("author").get("name")
-        message_content = message.get("message")
-        message_datetime = int(message.get("timestamp") / 1000 / 1000)
-        duration = starttime - datetime.datetime.fromtimestamp(message_datetime)
-        duration_in_minutes = abs(divmod(duration.total_seconds(), 60)[0])
-        
-        # add the message to the dataframe
-        df.loc[len(df), ['time', 'timestamp', 'user','message']] = duration_in_minutes, abs(duration.total_seconds()), user, message_content
+        append(message.get("timestamp"), message.get("author").get("name"), message.get("message"))
+
+        if progress is not None and columns.count >= next_progress:
+            next_progress += PROGRESS_EVERY
+            if progress(columns.count, message_seconds, duration) is False:
+                raise FetchCancelled()
+    df = columns.to_dataframe()
+    if progress is not None:
+        progress(columns.count, duration if duration else message_seconds, duration)
+    elapsed = time.perf_counter() - t0
+
+    df.attrs['title'] = getattr(chat, 'title', None)
+    df.attrs['ingest_seconds'] = elapsed
+    df.attrs['ingest_rate'] = columns.count / elapsed if elapsed > 0 else 0.0
+    print("ingested " + str(columns.count) + " messages in " + f"{elapsed:.2f}" + "s (" + f"{df.attrs['ingest_rate']:.0f}" + " msg/s)")
+    return df
+
+FETCH_SEGMENTS = int(os.environ.get("CHAD_FETCH_SEGMENTS", "4"))
+FETCH_SEGMENT_MIN_SECONDS = 1800    # a VOD is only split in segments of at least 30 minutes
+FETCH_SEGMENT_RETRIES = 3
+FETCH_SEGMENT_BACKOFF = 2.0         # seconds before the first retry of a segment, doubled every retry
+
+def chatSegments(duration: float, segments: int):
+    # [start, end) second ranges covering a VOD, the last one has no end so nothing past the duration is lost
+    n = max(min(int(segments), int(duration // FETCH_SEGMENT_MIN_SECONDS)), 1)
+    bounds = [int(round(duration * i / n)) for i in range(n + 1)]
+    return [(bounds[i], bounds[i + 1] if i < n - 1 else None) for i in range(n)]
+
+class SegmentProgress:
+    # adds up the progress of the segments of one download for progress(messages, stream seconds, duration),
+    # a cancel or a failed segment stops the other segments at their next report
+
+    def __init__(self, progress, segments: int, duration: float):
+        self.progress = progress
+        self.duration = duration
+        self.messages = [0] * segments
+        self.covered = [0] * segments
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def report(self, i: int, messages: int, covered: float):
+        with self.lock:
+            self.messages[i] = messages
+            self.covered[i] = covered
+            if self.progress is not None and self.progress(sum(self.messages), sum(self.covered), self.duration) is False:
+                self.cancelled.set()
+        if self.cancelled.is_set():
+            raise FetchCancelled()
+
+PARTIAL_FLUSH_MESSAGES = 10000     # with a checkpoint, messages are written to disk every 10k messages
+PARTIAL_FLUSH_SECONDS = 10.0        # or every 10 seconds
+
+def ingestSegment(url: str, i: int, start_s: int, end_s: int, tracker: SegmentProgress, partial=None, batch_size: int = CHAT_BATCH_SIZE):
+    # (timestamp, user, message) arrays of the messages in [start_s, end_s)
+    # chat_downloader includes both ends of the range, a message on a boundary is kept by the segment starting there
+    # with a PartialChat the messages are appended to it as they come and None is returned, the segment starts
+    # again from its checkpoint: the offset reached and how many messages of that second were already written
+    written, offset, at_offset = 0, None, 0
+    if partial is not None:
+        segment = partial.segment(i)
+        written, offset, at_offset = segment['messages'], segment['offset'], segment['at_offset']
+        if segment['done']:
+            tracker.report(i, written, (end_s if end_s is not None else tracker.duration) - start_s)
+            return None
+
+    chat = ChatDownloader().get_chat(url, start_time=start_s if offset is None else offset, end_time=end_s)
+    columns = ChatColumns(batch_size)
+    append = columns.append
+    next_progress = PROGRESS_EVERY
+    skip = at_offset
+    last_s, at_last = offset, at_offset
+    origin = None
+    next_flush = PARTIAL_FLUSH_MESSAGES
+    last_flush = time.monotonic()
 
+    for message in chat:
+        message_seconds = message.get("time_in_seconds")
+        if message_seconds is None:
+            if i > 0 or offset is not None:
+                continue
+        elif message_seconds < start_s or (end_s is not None and message_seconds >= end_s):
+            continue
+        elif offset is not None and message_seconds <= offset:
+            if message_seconds < offset or skip > 0:
+                skip -= message_seconds == offset
+                continue
+        timestamp = message.get("timestamp")
+        append(timestamp, message.get("author").get("name"), message.get("message"))
+
+        if partial is not None and message_seconds is not None:
+            if message_seconds == last_s:
+                at_last += 1
+            else:
+                last_s, at_last = message_seconds, 1
+            if origin is None:
+                origin = timestamp - int(message_seconds * 1000000)
+
+        if columns.count >= next_progress:
+            next_progress += PROGRESS_EVERY
+            tracker.report(i, written + columns.count, (message_seconds or start_s) - start_s)
+            if partial is not None and (columns.count >= next_flush or time.monotonic() - last_flush >= PARTIAL_FLUSH_SECONDS):
+                partial.append(i, columns.drain(), last_s, at_last, origin)
+                next_flush = columns.count + PARTIAL_FLUSH_MESSAGES
+                last_flush = time.monotonic()
+    tracker.report(i, written + columns.count, (end_s if end_s is not None else tracker.duration) - start_s)
+    if partial is not None:
+        partial.append(i, columns.drain(), last_s, at_last, origin, done=True)
+        return None
+    return columns.arrays()
+
+def fetchSegment(url: str, i: int, start_s: int, end_s: int, tracker: SegmentProgress, retries: int, partial=None):
+    # a failed segment is downloaded again on its own, the other segments keep going
+    # with a checkpoint it goes on from where it stopped
+    for attempt in range(retries + 1):
+        try:
+            return ingestSegment(url, i, start_s, end_s, tracker, partial)
+        except FetchCancelled:
+            raise
+        except Exception as e:
+            if attempt == retries or tracker.cancelled.is_set():
+                raise
+            print("segment " + str(i + 1) + " of " + url + " failed (" + str(e) + "), retry " + str(attempt + 1) + "/" + str(retries))
+            tracker.report(i, 0, 0)
+            tracker.cancelled.wait(FETCH_SEGMENT_BACKOFF * 2 ** attempt)
+
+@timedStage
+def ingestSegments(url: str, duration: float, segments: int, progress=None, retries: int = FETCH_SEGMENT_RETRIES, partial=None, title: str = None):
+    # download the chat of a VOD as time segments in parallel and merge them in time order
+    # with a PartialChat the segments of an interrupted download are resumed and the chat is read back from it
+    ranges = chatSegments(duration, segments)
+    if partial is not None:
+        ranges = partial.start(url, duration, ranges, title)
+    tracker = SegmentProgress(progress, len(ranges), duration)
+    parts = [None] * len(ranges)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="chad-segment") as executor:
+        futures = {executor.submit(fetchSegment, url, i, start_s, end_s, tracker, retries, partial): i for i, (start_s, end_s) in enumerate(ranges)}
+        try:
+            for future in as_completed(futures):
+                parts[futures[future]] = future.result()
+        except BaseException:
+            tracker.cancelled.set()
+            raise
+    if partial is not None:
+        parts = [partial.arrays()]
+
+    # the segments follow each other, only messages arriving out of order need the sort
+    timestamp, user, message = (np.concatenate([part[k] for part in parts]) for k in range(3))
+    if len(timestamp) > 1 and (np.diff(timestamp) < 0).any():
+        order = np.argsort(timestamp, kind='stable')
+        timestamp, user, message = timestamp[order], user[order], message[order]
+    df = chatFrame(timestamp, user, message)
+    if progress is not None:
+        progress(len(df), duration, duration)
+    elapsed = time.perf_counter() - t0
+
+    df.attrs['ingest_seconds'] = elapsed
+    df.attrs['ingest_rate'] = len(df) / elapsed if elapsed > 0 else 0.0
+    print("ingested " + str(len(df)) + " messages in " + f"{elapsed:.2f}" + "s (" + f"{df.attrs['ingest_rate']:.0f}" + " msg/s) from " + str(len(ranges)) + " segments")
     return df
 
+def loadChat_fromURL(url: str, progress=None, segments: int = None, partial=None):
+    # VODs long enough are downloaded as segments in parallel, live streams and short VODs in one go
+    # partial is the PartialChat checkpointing a VOD download, live streams cannot be resumed and ignore it
+    chat = ChatDownloader().get_chat(url)
+    duration = getattr(chat, 'duration', None)
+    title = getattr(chat, 'title', None)
+    segments = FETCH_SEGMENTS if segments is None else segments
+    if duration and (partial is not None or len(chatSegments(duration, segments)) > 1):
+        df = ingestSegments(url, duration, segments, progress=progress, partial=partial, title=title)
+        df.attrs['title'] = title
+        return df
+    return ingestChat(chat, progress=progress)
+
 def loadChat_fromCSV(path: str):
     df = pd.read_csv(path, comment='#', engine='c')
     return df
@@ -110,201 +568,1310 @@ def saveChat_toCSV(df, path: str):
 def saveChat_toEditingCSV(df, path: str):
     return;
 
-def saveMarker_toDaVinciEDL(df_edl, path: str):
-
-    f = open(path, "w")
-    f.write("TITLE: marker\n")
-    f.write("FCM: NON-DROP FRAME\n\n")
-
-    for index, row in df_edl.iterrows():
-        f.write(str(int(index)+1) + "  001      V     C        " + str(row['start']) + " " + str(row['end']) + " " + str(row['start']) + " " + str(row['end']) + "\n")
-        f.write(" |C:ResolveColor" + row['color'] + " |M:" + row['note'] + " |D:" + str(row["duration"]) + "\n\n")
-    f.close()
+EDL_HEADER = "TITLE: marker\nFCM: NON-DROP FRAME\n\n"
+
+def edlTimecodes(seconds):
+    # HH:MM:SS:FF timecodes for a whole column of second offsets, markers are always on frame 00
+    s = np.asarray(seconds, dtype=np.float64).astype(np.int64)
+    h, rem = np.divmod(s, 3600)
+    m, sec = np.divmod(rem, 60)
+    return np.char.zfill(h.astype(str), 2).astype(object) + ":" + TWO_DIGITS[m] + ":" + TWO_DIGITS[sec] + ":00"
+
+def edlMarkers(df_edl):
+    # (start, end, note, color, duration) for every row of a marker dataframe
+    return zip(df_edl['start'], df_edl['end'], df_edl['note'], df_edl['color'], df_edl['duration'])
+
+@timedStage
+def writeEDL(f, markers):
+    # markers is any iterable of (start, end, note, color, duration), a generator is never materialised
+    f.write(EDL_HEADER)
+    f.writelines(
+        str(i) + "  001      V     C        " + str(start) + " " + str(end) + " " + str(start) + " " + str(end) + "\n"
+        + " |C:ResolveColor" + str(color) + " |M:" + str(note).replace("\n", " ") + " |D:" + str(duration) + "\n\n"
+        for i, (start, end, note, color, duration) in enumerate(markers, 1)
+    )
+
+def saveMarker_toDaVinciEDL(markers, path: str):
+    # markers is a dataframe with start, end, note, color and duration columns, or an iterable of those tuples
+    if isinstance(markers, pd.DataFrame):
+        markers = edlMarkers(markers)
+    with open(path, "w", buffering=1 << 20) as f:
+        writeEDL(f, markers)
+
+def chatMarkers(df, color: str):
+    # one marker of one frame per chat message
+    timecodes = edlTimecodes(df['timestamp'].to_numpy())
+    return zip(timecodes, timecodes, df['message'], itertools.repeat(color), itertools.repeat(1))
 
 def saveChat_toDaVinciEDL(df, path: str, color: str):
-    df_edl = pd.DataFrame(columns=['start', 'end', 'note', 'color', 'duration'])
-
-    for index, row in df.iterrows():
-        start = time_formatSec(row['timestamp'], 0) + ":00"
-        start = start.replace(':', '')
-        start = start.zfill(8)
-        start = start[:2] + ':' + start[2:4] + ':' + start[4:6] + ':' + start[6:]
-
-        end = start
-        note = row['message']
-        colour = color
-        duration = 1
-        new_row = {'start': start, 'end': end, 'note': note, 'color': colour, 'duration': duration}
-        df_edl.loc[len(df_edl)] = new_row
-
-        saveMarker_toDaVinciEDL(df_edl, path)
-
+    saveMarker_toDaVinciEDL(chatMarkers(df, color), path)
     return;
 
 
+VODTS_TIME = re.compile(r"^(?:(\d+):)?(\d+):(\d+)$")
+VODTS_COLORS = np.array(['Yellow', 'Green', 'Purple', 'Red', 'Blue'], dtype=object)
+
 def load_vodts_marker(path: str):
     # vodts format is one timestamp per line, h:mm:ss {type} {note}
     # where type is None for chapter, . for subchapter, .. for subchapter timestamp, ... for misc timestamp, .... for editor note
 
-    df = pd.DataFrame(columns=['start', 'end', 'note', 'color', 'duration'])
-
-    f = open
+    # the first 3 lines are the header
     with open(path, 'r') as f:
-        i = 0
-        for line in f:
-            i = i+1
-            if i<4:
-                continue
-            timeS = line.split(' ')[0]
-            timeS = timeS + ":00"
-            timeS = timeS.replace(':', '')
-            timeS = timeS.zfill(8)
-            timeS = timeS[:2] + ':' + timeS[2:4] + ':' + timeS[4:6] + ':' + timeS[6:]
-
-
-            timeE = timeS
-
-            note = line.split(' ', 1)[1]
-            note = note.replace('\n', '')
-
-            color = 'Yellow'
-            if(note.startswith('....')):
-                color = 'Blue'
-                note = note[5:]
-            elif(note.startswith('...')):
-                color = 'Red'
-                note = note[4:]
-            elif(note.startswith('..')):
-                color = 'Purple'
-                note = note[3:]
-            elif(note.startswith('.')):
-                color = 'Green'
-                note = note[2:]
-
-            new_row = {'start': timeS, 'end': timeE, 'note': note, 'color': color, 'duration': 1}
-            df.loc[len(df)] = new_row
-
+        lines = pd.Series(f.read().splitlines()[3:], dtype=object)
+    lines = lines[lines.str.strip() != '']
+
+    parts = lines.str.split(' ', n=1, expand=True).reindex(columns=[0, 1])
+    hms = parts[0].str.extract(VODTS_TIME).astype(np.float64)
+    valid = hms.notna()[[1, 2]].all(axis=1).to_numpy()
+    if not valid.all():
+        print(path + ": skipped " + str(int((~valid).sum())) + " lines without a timestamp")
+    hms = hms[valid].fillna(0).to_numpy()
+    note = parts[1][valid].fillna('')
+
+    # the number of leading dots is the marker level, the dots and the space after them are not part of the note
+    level = note.str.len() - note.str.lstrip('.').str.len()
+    level = np.minimum(level.to_numpy(), 4)
+    note = note.str.replace(r"^\.{1,4}.?", '', regex=True)
+
+    start = edlTimecodes(hms[:, 0] * 3600 + hms[:, 1] * 60 + hms[:, 2])
+    df = pd.DataFrame({'start': start, 'end': start, 'note': note.to_numpy(), 'color': VODTS_COLORS[level], 'duration': 1})
     return df
 
+HTTP_TIMEOUT = (5, 10)          # connect, read
+TITLE_TTL = 7 * 24 * 3600       # titles are looked up again after a week
+TITLE_RETRY_TTL = 300           # a failed lookup is not tried again for 5 minutes
+TITLE_MAX_BYTES = 1024 * 1024   # stop reading a page after this if no title was found
+
+YOUTUBE_TITLE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+TWITCH_TITLE = re.compile(r"<meta[^>]*property=[\"']og:title[\"'][^>]*>", re.IGNORECASE)
+META_CONTENT = re.compile(r"content=(?:\"([^\"]*)\"|'([^']*)')", re.IGNORECASE)
+
+http_session = None
+http_session_lock = threading.Lock()
+
+def httpSession():
+    # shared keep-alive session, created on the first title lookup
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            session = requests.Session()
+            session.headers.update({'User-Agent': 'Mozilla/5.0 (chad ' + __SOFT_VERSION__ + ')', 'Accept-Language': 'en-US,en;q=0.8'})
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+            http_session = session
+    return http_session
+
+def fetchUntil(url: str, pattern):
+    # stream the page through the shared keep-alive session and stop as soon as pattern matches
+    text = ""
+    with httpSession().get(url, timeout=HTTP_TIMEOUT, stream=True) as response:
+        response.encoding = response.encoding or 'utf-8'
+        for chunk in response.iter_content(chunk_size=16384, decode_unicode=True):
+            text += chunk
+            m = pattern.search(text)
+            if m is not None:
+                return m
+            if len(text) > TITLE_MAX_BYTES:
+                break
+    return None
+
 def get_youtube_title(url: str):
-    
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
 
     # get the title of the video
-    if soup.title:
-        title = soup.title.string.replace(' - YouTube', '')
+    m = fetchUntil(url, YOUTUBE_TITLE)
+    if m:
+        title = unescape(m.group(1)).strip().replace(' - YouTube', '')
     else:
         title = None
 
     return title
 
 def get_twitch_title(url: str):
-    
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
 
     # get the title of the video
-    meta_tag = soup.find('meta', property='og:title')
-    if meta_tag:
-        title = meta_tag['content']
+    m = fetchUntil(url, TWITCH_TITLE)
+    content = META_CONTENT.search(m.group(0)) if m else None
+    if content:
+        title = unescape(content.group(1) if content.group(1) is not None else content.group(2))
     else:
         title = None
 
     return title
 
+@timedStage
 def webScraping(url: str):
 
     # if youtube, get the title of the video
-    if "youtube" in url:
-        title = get_youtube_title(url)
-    elif "twitch" in url:
-        title = get_twitch_title(url)
-    else:
+    try:
+        if "youtube" in url or "youtu.be" in url:
+            title = get_youtube_title(url)
+        elif "twitch" in url:
+            title = get_twitch_title(url)
+        else:
+            title = None
+    except requests.RequestException as e:
+        print("title lookup of " + url + " failed: " + str(e))
         title = None
     return title;
 
+titles = {}
+title_failures = {}     # key -> time of the last failed lookup, kept in memory only
+titles_lock = threading.Lock()
+
+def getTitle(url: str):
+    # title of a video, from memory, then from the disk cache, then from the page, kept for TITLE_TTL
+    # blocks for up to HTTP_TIMEOUT, call it from a download thread rather than from a callback
+    key = cacheKey(url) or url
+    now = time.time()
+
+    with titles_lock:
+        entry = titles.get(key)
+        failed = now - title_failures.get(key, -TITLE_RETRY_TTL) < TITLE_RETRY_TTL
+        if entry is None and not failed:
+            titles.update(titlesRead())
+            entry = titles.get(key)
+    if entry is not None and (now - entry['time'] < TITLE_TTL or failed):
+        return entry['title']
+    if failed:
+        return None
+
+    title = webScraping(url)
+    if title is None:
+        with titles_lock:
+            title_failures[key] = now
+        return entry['title'] if entry is not None else None
+
+    with titles_lock:
+        titles[key] = {'title': title, 'time': now}
+        titlesWrite(titles)
+    return title
+
 # ------------------------  ------------------------  ------------------------
 # ------------ ------------------------  ------------------------ ------------
-# Processing functions used to process the data
+# On-disk chat cache, one parquet file per VOD
 # ------------ ------------------------  ------------------------ ------------
 # ------------------------  ------------------------  ------------------------
 
-def printChat_withURL(url, df):#
-    # print the chat messages with the URL+timestamp
-    print("Chat Messages from " + url)
+CACHE_DIR = os.environ.get("CHAD_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "chad"))
+CACHE_MAX_MB = float(os.environ.get("CHAD_CACHE_MAX_MB", "2048"))
+
+# urls naming one video, channel urls (youtube.com/@name/live, twitch.tv/name) show a different stream over time
+VIDEO_ID_PATTERNS = [
+    ("youtube", re.compile(r"youtube\.com/.*[?&]v=([A-Za-z0-9_-]+)")),
+    ("youtube", re.compile(r"youtu\.be/([A-Za-z0-9_-]+)")),
+    ("youtube", re.compile(r"youtube\.com/(?:live|shorts|embed)/([A-Za-z0-9_-]+)")),
+    ("twitch", re.compile(r"twitch\.tv/videos/([0-9]+)")),
+]
+
+def videoId(url: str):
+    # (platform, video id) when the url names one video, None otherwise
+    if url is None:
+        return None
+    for platform, pattern in VIDEO_ID_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return platform, match.group(1)
+    return None
+
+def cacheKey(url: str):
+    # platform_videoid, None for urls that are not one video (they are not cached)
+    video = videoId(url)
+    if video is None:
+        return None
+    platform, vidId = video
+    return platform + "_" + vidId
+
+def cachePath(key: str):
+    return os.path.join(CACHE_DIR, key + ".parquet")
+
+def cacheIndexPath(key: str):
+    return os.path.join(CACHE_DIR, key + ".index.npz")
+
+def cacheEntries():
+    # list the cached chats, least recently used first
+    if not os.path.isdir(CACHE_DIR):
+        return []
+
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".partial"):
+            # an unfinished download, listed as <key>.partial
+            entry = partialEntry(name)
+            if entry is not None:
+                entries.append(entry)
+            continue
+        if not name.endswith(".parquet"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        key = name[:-len(".parquet")]
+        st = os.stat(path)
+        size = st.st_size
+        if os.path.exists(cacheIndexPath(key)):
+            size += os.path.getsize(cacheIndexPath(key))
+        entries.append({'key': key, 'path': path, 'size': size, 'used': st.st_mtime})
+    entries.sort(key=lambda e: e['used'])
+    return entries
+
+def partialEntry(name: str):
+    # size and last write of a <key>.partial directory, None if it went away meanwhile
+    path = os.path.join(CACHE_DIR, name)
+    try:
+        stats = [os.stat(os.path.join(path, f)) for f in os.listdir(path)] + [os.stat(path)]
+    except FileNotFoundError:
+        return None
+    return {'key': name, 'path': path, 'size': sum(st.st_size for st in stats[:-1]), 'used': max(st.st_mtime for st in stats)}
+
+def cacheRemove(key: str):
+    # False for the partial download of a video being downloaded, it is kept
+    if key.endswith(".partial"):
+        with partialLock(key[:-len(".partial")], blocking=False) as locked:
+            if locked:
+                shutil.rmtree(os.path.join(CACHE_DIR, key), ignore_errors=True)
+        return locked
+
+    for path in [cachePath(key), cacheIndexPath(key), os.path.join(CACHE_DIR, key + ".json")]:
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+def cacheEvict(max_mb: float = None):
+    # remove the least recently used entries until the cache fits in max_mb
+    if max_mb is None:
+        max_mb = CACHE_MAX_MB
+    entries = cacheEntries()
+    total = sum(e['size'] for e in entries)
+    removed = []
+    for e in entries:
+        if total <= max_mb * 1024 * 1024:
+            break
+        if cacheRemove(e['key']):
+            total -= e['size']
+            removed.append(e['key'])
+    return removed
+
+@timedStage
+def cacheRead(key: str):
+    path = cachePath(key)
+    if not os.path.exists(path):
+        return None
+    # messages stay in arrow memory, users come back as a categorical from the parquet dictionary
+    table = pq.read_table(path)
+    df = compactChat(table.to_pandas(types_mapper={pa.string(): CHAT_MESSAGE_DTYPE, pa.large_string(): CHAT_MESSAGE_DTYPE}.get))
+    df.attrs['title'] = cacheReadMeta(key).get('title')
+    os.utime(path)  # mark as recently used for the LRU eviction
+    return df
 
-    # extract the last part of the url
+@timedStage
+def cacheWrite(key: str, url: str, df):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # write to a temp file first so a reader never sees a half written file
+    path = cachePath(key)
+    tmp = path + "." + str(os.getpid()) + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+    # the token index is built at ingestion and saved next to the chat
+    cacheWriteIndex(key, TokenIndex.build(df['message'].to_numpy()))
+
+    with open(os.path.join(CACHE_DIR, key + ".json"), "w") as f:
+        json.dump({'url': url, 'title': df.attrs.get('title'), 'messages': len(df), 'created': time.time()}, f)
+
+    cacheEvict()
+
+def cacheWriteIndex(key: str, index):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cacheIndexPath(key)
+    tmp = path + "." + str(os.getpid()) + ".tmp.npz"
+    index.save(tmp)
+    os.replace(tmp, path)
+
+def cacheReadIndex(key: str, nrows: int):
+    # the saved index of a cached chat, None if missing or built for another version of the chat
+    path = cacheIndexPath(key)
+    if key is None or not os.path.exists(path):
+        return None
+    index = TokenIndex.load(path)
+    if index.nrows != nrows:
+        return None
+    return index
+
+def titlesRead():
+    path = os.path.join(CACHE_DIR, "titles.json")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def titlesWrite(entries):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, "titles.json")
+    tmp = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp, path)
+
+def cacheReadMeta(key: str):
+    path = os.path.join(CACHE_DIR, key + ".json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def partialPath(key: str):
+    return os.path.join(CACHE_DIR, key + ".partial")
+
+PARTIAL_LOCKS = {}      # key -> threading.Lock of the downloads of that video in this process
+PARTIAL_LOCKS_LOCK = threading.Lock()
+
+@contextlib.contextmanager
+def partialLock(key: str, blocking: bool = True):
+    # one download of a video at a time in CACHE_DIR, between the threads of this process and the other chad
+    # processes (dashboard, batch), yields False when busy and not blocking
+    # <key>.partial.lock is flock'ed where fcntl exists, the OS releases it if the process dies
+    with PARTIAL_LOCKS_LOCK:
+        lock = PARTIAL_LOCKS.setdefault(key, threading.Lock())
+    if not lock.acquire(blocking):
+        yield False
+        return
+
+    f = None
+    try:
+        path = partialPath(key) + ".lock"
+        while fcntl is not None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            f = open(path, "a")
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                f.close()
+                f = None
+                break
+            # the previous holder removes the file, keep the lock only if it is still the file at path
+            try:
+                if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+            f = None
+
+        if fcntl is not None and f is None:
+            yield False
+        else:
+            yield True
+    finally:
+        if f is not None:
+            os.remove(path)
+            f.close()
+        lock.release()
+
+class PartialChat:
+    # a download in progress, kept in CACHE_DIR/<key>.partial/ as append-only parquet parts of the messages
+    # (<segment>-<part>.parquet) and a checkpoint.json with, for every segment, the parts written and the
+    # stream offset reached. A failed or cancelled download of the same video goes on from there, and
+    # the dashboard can read the parts written so far while the download continues
+
+    def __init__(self, key: str):
+        self.key = key
+        self.path = partialPath(key)
+        self.lock = threading.Lock()
+        self.checkpoint = None
+        try:
+            with open(os.path.join(self.path, "checkpoint.json"), "r") as f:
+                self.checkpoint = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def start(self, url: str, duration: float, ranges, title: str = None):
+        # the ranges of an interrupted download are kept so its segments can resume, returns the ranges to fetch
+        # the title of the chat is kept with them for the previews of the download
+        with self.lock:
+            if self.checkpoint is None or self.checkpoint.get('duration') != duration:
+                shutil.rmtree(self.path, ignore_errors=True)
+                os.makedirs(self.path, exist_ok=True)
+                self.checkpoint = {'url': url, 'duration': duration, 'title': title, 'origin': None, 'segments': [
+                    {'start': start_s, 'end': end_s, 'offset': None, 'at_offset': 0, 'parts': 0, 'messages': 0, 'done': False} for start_s, end_s in ranges]}
+                self.save()
+            else:
+                if title and not self.checkpoint.get('title'):
+                    self.checkpoint['title'] = title
+                    self.save()
+                print("resuming " + self.key + " from " + f"{self.messages():,}" + " messages")
+            return [(segment['start'], segment['end']) for segment in self.checkpoint['segments']]
+
+    def segment(self, i: int):
+        with self.lock:
+            return dict(self.checkpoint['segments'][i])
+
+    def append(self, i: int, arrays, offset: float, at_offset: int, origin: int = None, done: bool = False):
+        # write a part of segment i, then record it with the offset reached, a part not in the checkpoint is ignored
+        # every segment is written by a single thread, its parts can be written outside the lock
+        timestamp, user, message = arrays
+        segment = self.segment(i)
+        if len(timestamp) > 0:
+            path = os.path.join(self.path, "%02d-%05d.parquet" % (i, segment['parts']))
+            tmp = path + ".tmp"
+            pq.write_table(pa.table({'timestamp': timestamp, 'user': pa.array(user, pa.string()), 'message': pa.array(message, pa.string())}), tmp)
+            os.replace(tmp, path)
+
+        with self.lock:
+            segment = self.checkpoint['segments'][i]
+            if len(timestamp) > 0:
+                segment['parts'] += 1
+                segment['messages'] += len(timestamp)
+                segment['offset'] = offset
+                segment['at_offset'] = at_offset
+                if self.checkpoint['origin'] is None and origin is not None:
+                    self.checkpoint['origin'] = origin
+            segment['done'] = done
+            self.save()
+
+    def save(self):
+        path = os.path.join(self.path, "checkpoint.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp, path)
+
+    def messages(self):
+        if self.checkpoint is None:
+            return 0
+        return sum(segment['messages'] for segment in self.checkpoint['segments'])
+
+    def arrays(self):
+        # (timestamp, user, message) of the recorded parts, in segment and part order
+        parts = []
+        for i, segment in enumerate(self.checkpoint['segments'] if self.checkpoint else []):
+            for p in range(segment['parts']):
+                parts.append(pq.read_table(os.path.join(self.path, "%02d-%05d.parquet" % (i, p))))
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0, dtype=object)
+        table = pa.concat_tables(parts)
+        return (table['timestamp'].to_numpy(), table['user'].to_numpy(zero_copy_only=False),
+                table['message'].to_numpy(zero_copy_only=False))
+
+    def read(self):
+        # the chat downloaded so far, None if nothing was written yet
+        if self.messages() == 0:
+            return None
+        timestamp, user, message = self.arrays()
+        order = np.argsort(timestamp, kind='stable')
+        # without the first segment the offsets are counted from the stream start estimated by the other ones
+        origin = None if self.checkpoint['segments'][0]['messages'] > 0 else self.checkpoint['origin']
+        df = chatFrame(timestamp[order], user[order], message[order], origin)
+        df.attrs['partial'] = True
+        df.attrs['title'] = self.checkpoint.get('title')
+        return df
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def loadChat_cached(url: str, refresh: bool = False, progress=None):
+    # load the chat from the cache, download and cache it if missing or if refresh is asked
+    # the download is checkpointed in a PartialChat, an interrupted one is resumed
+    key = cacheKey(url)
+    if key is None:
+        return loadChat_fromURL(url, progress)
+
+    requested = time.time()
+    with partialLock(key):
+        # another download of the video (thread or process) may have cached it while this one waited
+        path = cachePath(key)
+        if not refresh or (os.path.exists(path) and os.path.getmtime(path) >= requested):
+            t0 = time.perf_counter()
+            df = cacheRead(key)
+            if df is not None:
+                print("loaded " + key + " from cache in " + f"{(time.perf_counter() - t0) * 1000:.0f}" + "ms")
+                return df
+
+        partial = PartialChat(key)
+        df = loadChat_fromURL(url, progress, partial=partial)
+
+        # the title is looked up once here and kept with the cached chat
+        if not df.attrs.get('title'):
+            df.attrs['title'] = getTitle(url)
+        cacheWrite(key, url, df)
+        partial.remove()
+    return df
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Activity histograms, message counts precomputed at several bin widths
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+PYRAMID_WIDTHS = [1, 10, 60, 300]   # bin widths in seconds, finest first
+PYRAMID_MAX_BINS = 720              # the finest width giving at most this many bins in view is used
+BIN_WIDTHS = [1, 5, 10, 15, 30, 60, 300]   # widths offered in the dashboard, any whole number of seconds works
+
+def rebin(counts, width: int):
+    # sum consecutive groups of width bins along the last axis, the last group is padded with zeros
+    if width == 1:
+        return counts
+    pad = (-counts.shape[-1]) % width
+    if pad:
+        counts = np.concatenate([counts, np.zeros(counts.shape[:-1] + (pad,), dtype=counts.dtype)], axis=-1)
+    return counts.reshape(counts.shape[:-1] + (-1, width)).sum(axis=-1)
+
+def smoothCounts(counts, window: int):
+    # centered moving average over window bins along the last axis, the edges average the bins they have
+    if not window or window <= 1 or counts.shape[-1] == 0:
+        return counts
+    kernel = np.ones(int(window))
+    norm = np.convolve(np.ones(counts.shape[-1]), kernel, mode='same')
+    return np.apply_along_axis(lambda row: np.convolve(row, kernel, mode='same') / norm, -1, counts)
+
+def binLabel(width: int):
+    if width % 60 == 0:
+        return str(width // 60) + " min"
+    return str(width) + " s"
+
+class ActivityPyramid:
+    # counts of messages per 1s, 10s, 1min and 5min, built once from the second offsets,
+    # range and zoom queries are then answered by slicing the arrays
+    # with codes the counts have one row per key (e.g. the terms of a keyword query),
+    # all the rows come from the same bincount and levels holds their total
+
+    def __init__(self, seconds, duration: int = 0, codes=None, keys=None):
+        seconds = np.asarray(seconds, dtype=np.int64)
+        self.duration = max(duration, int(seconds.max()) + 1 if len(seconds) > 0 else 0, 1)
+        self.keys = list(keys) if keys is not None else None
+        nkeys = len(self.keys) if self.keys is not None else 1
+
+        flat = seconds if codes is None else np.asarray(codes, dtype=np.int64) * self.duration + seconds
+        base = np.bincount(flat, minlength=nkeys * self.duration).reshape(nkeys, self.duration)
+        self.rows = {}
+        self.levels = {}
+        for width in PYRAMID_WIDTHS:
+            self.rows[width] = rebin(base, width)
+            self.levels[width] = self.rows[width][0] if nkeys == 1 else self.rows[width].sum(axis=0)
+        self.nbytes = sum(r.nbytes for r in self.rows.values()) + (sum(l.nbytes for l in self.levels.values()) if nkeys > 1 else 0)
+
+    def width_for(self, start_s: float, end_s: float, max_bins: int = PYRAMID_MAX_BINS):
+        span = max(end_s - start_s, 1)
+        for width in PYRAMID_WIDTHS:
+            if span / width <= max_bins:
+                return width
+        return PYRAMID_WIDTHS[-1]
+
+    def query(self, start_s: float, end_s: float, width: int = None, per_key: bool = False):
+        # bins overlapping [start_s, end_s), returns (width, bin start in seconds, counts)
+        # width is any whole number of seconds, it is summed from the coarsest level dividing it
+        # per_key gives a (keys, bins) matrix instead of the total
+        if not width:
+            width = self.width_for(start_s, end_s)
+        width = max(int(width), 1)
+        level = max(w for w in PYRAMID_WIDTHS if width % w == 0)
+        counts = self.rows[level] if per_key else self.levels[level]
+        factor = width // level
+
+        i0 = max(int(start_s // width), 0)
+        i1 = min(int(np.ceil(end_s / width)), int(np.ceil(self.duration / width)))
+        if i1 <= i0:
+            return width, np.empty(0, dtype=np.int64), counts[..., :0]
+        return width, np.arange(i0, i1, dtype=np.int64) * width, rebin(counts[..., i0 * factor:i1 * factor], factor)
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Dataset registry, the loaded chats are kept server side and the dashboard
+# sessions only store a handle to them
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+DATASET_MAX_MB = float(os.environ.get("CHAD_DATASET_MAX_MB", "4096"))
+DATASET_GENERATION = itertools.count(1)     # every ChatDataset gets the next one, cached query results are keyed on it
+KEYWORD_PYRAMIDS = 8                        # keyword pyramids kept per dataset, counted in its nbytes
+
+class ChatDataset:
+    # a loaded chat, shared by every session looking at the same VOD
+
+    def __init__(self, handle: str, url: str, df, indexed: bool = True):
+        # the title is looked up by the download (loadChat_cached, FetchJobs.run), never here in a callback
+        self.title = df.attrs.get('title')
+
+        # range queries rely on the chat being sorted by time, the token index on row positions
+        df = compactChat(df)
+        resorted = not df['timestamp'].is_monotonic_increasing or not isinstance(df.index, pd.RangeIndex)
+        if resorted:
+            df = df.sort_values('timestamp', kind='stable', ignore_index=True)
+
+        self.handle = handle
+        self.generation = next(DATASET_GENERATION)
+        self.url = url
+        self.df = df
+        self.pyramid = ActivityPyramid(df['timestamp'].to_numpy())
+        self.keyword_pyramids = OrderedDict()
+        self.keyword_nbytes = 0
+        self.lock = threading.Lock()
+
+        # live snapshots are short lived and skip the token index, keyword queries then scan the messages
+        self.index = None
+        if indexed:
+            self.index = None if resorted else cacheReadIndex(handle, len(df))
+            if self.index is None:
+                self.index = TokenIndex.build(df['message'].to_numpy())
+                if not resorted and os.path.exists(cachePath(handle)):
+                    cacheWriteIndex(handle, self.index)
+
+        # user name -> rows, with the message count and first/last message of every user
+        self.users = UserIndex.build(df['user'], df['timestamp'].to_numpy())
+
+        self.base_nbytes = (int(df.memory_usage(deep=True).sum()) + (self.index.nbytes if self.index is not None else 0) + self.users.nbytes
+                            + self.pyramid.nbytes)
+
+    @property
+    def nbytes(self):
+        # grows with the keyword pyramids, the registry checks it again when one is added
+        return self.base_nbytes + self.keyword_nbytes
+
+    def keywordPyramid(self, keyword: str, user: str):
+        # activity pyramid of the messages matching keyword/user, the last few are kept
+        key = (keyword, user)
+        with self.lock:
+            pyramid = self.keyword_pyramids.get(key)
+            if pyramid is not None:
+                self.keyword_pyramids.move_to_end(key)
+                return pyramid
+
+        filtered = filter_data(self.df, None, None, keyword, user, self.index, self.users)
+        terms, codes = keywordCodes(keyword, filtered['keywordFound'].to_numpy())
+        pyramid = ActivityPyramid(filtered['timestamp'].to_numpy(), self.pyramid.duration, codes, terms)
+
+        with self.lock:
+            if key not in self.keyword_pyramids:
+                self.keyword_pyramids[key] = pyramid
+                self.keyword_nbytes += pyramid.nbytes
+            while len(self.keyword_pyramids) > KEYWORD_PYRAMIDS:
+                self.keyword_nbytes -= self.keyword_pyramids.popitem(last=False)[1].nbytes
+        DATASETS.trim()
+        return pyramid
+
+    def slice(self, start_s: float, end_s: float):
+        # messages with start_s <= timestamp < end_s, binary search on the sorted offsets
+        ts = self.df['timestamp'].to_numpy()
+        i0 = np.searchsorted(ts, start_s, side='left')
+        i1 = np.searchsorted(ts, end_s, side='left')
+        return self.df.iloc[i0:i1]
+
+    def topChatters(self, start_s: float, end_s: float, k: int = 10):
+        # (messages in [start_s, end_s), the k users with the most of them) from the user index
+        def compute():
+            ts = self.df['timestamp'].to_numpy()
+            i0 = int(np.searchsorted(ts, start_s, side='left'))
+            i1 = int(np.searchsorted(ts, end_s, side='left'))
+            return i1 - i0, self.users.top(i0, i1, ts, k)
+        return QUERY_CACHE.get(self, 'top_chatters', (queryTime(start_s), queryTime(end_s), k), compute)
+
+QUERY_CACHE_MAX_MB = float(os.environ.get("CHAD_QUERY_CACHE_MB", "256"))
+QUERY_CACHE_ENTRIES = 256
+QUERY_CACHE_TTL = float(os.environ.get("CHAD_QUERY_CACHE_TTL", "900"))   # seconds
+
+def queryTime(seconds):
+    # time bounds of a query signature, to the millisecond so float noise from the zoom does not miss the cache
+    return None if seconds is None else round(float(seconds), 3)
+
+def queryTerms(keyword):
+    # keyword query signature, "lol,kekw" and "lol, kekw" are the same query
+    return parseKeywords(keyword) if keyword else ()
+
+def queryUsers(user):
+    # user query signature, the order and case of the names do not matter
+    if not user:
+        return ()
+    names, patterns = userQuery(user)
+    return tuple(sorted(set(names))) + tuple(sorted("re:" + p.pattern for p in patterns))
+
+def resultBytes(value):
+    # rough memory of a cached result
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(resultBytes(v) for v in value)
+    if hasattr(value, 'to_plotly_json'):
+        return 64 + sum(resultBytes(value[k]) for k in ('x', 'y') if value[k] is not None)
+    return 64
+
+class QueryCache:
+    # LRU of query results (filtered rows, activity series, top chatters) with a TTL, bounded by memory,
+    # keyed by (dataset handle, dataset generation, kind, normalised parameters)
+    # a result being computed is waited for instead of computed a second time, e.g. when two callbacks
+    # fire for the same change. Results are shared, callers must not modify them
+
+    def __init__(self, max_mb: float, max_entries: int, ttl: float):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key -> (value, bytes, created)
+        self.pending = {}               # key -> Event set when the result is stored
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, dataset, kind: str, params, compute):
+        key = (dataset.handle, dataset.generation, kind, params)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                    self.remove(key)
+                    entry = None
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    METRICS.count('chad_query_cache_hits_total', kind)
+                    return entry[0]
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    break
+            event.wait()
+
+        METRICS.count('chad_query_cache_misses_total', kind)
+        try:
+            value = compute()
+            with self.lock:
+                size = resultBytes(value)
+                if size <= self.max_bytes:
+                    self.entries[key] = (value, size, time.monotonic())
+                    self.nbytes += size
+                    self.evict()
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+        return value
+
+    def remove(self, key):
+        self.nbytes -= self.entries.pop(key)[1]
+
+    def evict(self):
+        now = time.monotonic()
+        for key in [k for k, e in self.entries.items() if now - e[2] > self.ttl]:
+            self.remove(key)
+        while self.entries and (self.nbytes > self.max_bytes or len(self.entries) > self.max_entries):
+            self.remove(next(iter(self.entries)))
+
+    def invalidate(self, handle: str):
+        # drop the results of a dataset that was replaced or evicted
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == handle]:
+                self.remove(key)
+
+QUERY_CACHE = QueryCache(QUERY_CACHE_MAX_MB, QUERY_CACHE_ENTRIES, QUERY_CACHE_TTL)
+
+class DatasetRegistry:
+    # LRU of the loaded datasets, bounded by the total memory of their DataFrames
+
+    def __init__(self, max_mb: float):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.datasets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, url: str, df, handle: str = None, indexed: bool = True):
+        handle = handle or cacheKey(url) or uuid.uuid4().hex
+        dataset = ChatDataset(handle, url, df, indexed)
+
+        with self.lock:
+            self.datasets[handle] = dataset
+            self.datasets.move_to_end(handle)
+            self.evict()
+        QUERY_CACHE.invalidate(handle)
+        return handle
+
+    def get(self, handle: str):
+        with self.lock:
+            dataset = self.datasets.get(handle)
+            if dataset is not None:
+                self.datasets.move_to_end(handle)
+            return dataset
+
+    def discard(self, handle: str):
+        with self.lock:
+            self.datasets.pop(handle, None)
+        QUERY_CACHE.invalidate(handle)
+
+    def trim(self):
+        # evict again after a dataset grew (keyword pyramids)
+        with self.lock:
+            self.evict()
+
+    def evict(self):
+        # never evict the most recent dataset, even if it is bigger than the limit
+        total = sum(d.nbytes for d in self.datasets.values())
+        while total > self.max_bytes and len(self.datasets) > 1:
+            handle, dataset = self.datasets.popitem(last=False)
+            total -= dataset.nbytes
+            QUERY_CACHE.invalidate(handle)
+            print("evicted dataset " + handle)
+
+    def nbytes(self):
+        with self.lock:
+            return sum(d.nbytes for d in self.datasets.values())
+
+DATASETS = DatasetRegistry(DATASET_MAX_MB)
+
+def getDataset(stored_data):
+    # get the dataset of a session, reload it from the disk cache if it was evicted
+    if not stored_data or 'handle' not in stored_data:
+        return None
+
+    if stored_data.get('live'):
+        live = LIVE_CHATS.get(stored_data['handle'])
+        return live.dataset() if live is not None else None
+
+    dataset = DATASETS.get(stored_data['handle'])
+    if dataset is None:
+        if stored_data.get('partial'):
+            return partialDataset(stored_data['url'])
+        df = cacheRead(stored_data['handle'])
+        if df is None:
+            return None
+        DATASETS.put(stored_data['url'], df)
+        dataset = DATASETS.get(stored_data['handle'])
+    return dataset
+
+def previewHandle(key: str):
+    # the chat downloaded so far is registered apart, sessions showing the cached chat keep it
+    return "partial_" + key
+
+def partialDataset(url: str):
+    # dataset of the chat downloaded so far, without word index, None if nothing was written yet
+    # its title is the one of the chat recorded in the checkpoint
+    key = cacheKey(url)
+    df = PartialChat(key).read() if key is not None else None
+    if df is None:
+        return None
+    return DATASETS.get(DATASETS.put(url, df, previewHandle(key), indexed=False))
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Background fetch jobs, downloads run in worker threads and the dashboard
+# polls their progress
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+FETCH_WORKERS = int(os.environ.get("CHAD_FETCH_WORKERS", "2"))
+FETCH_JOB_TTL = 3600    # finished jobs are forgotten after an hour
+PARTIAL_PREVIEW_SECONDS = 30.0  # the dashboard reloads the chat downloaded so far at most this often
+
+class FetchJob:
+
+    def __init__(self, url: str, refresh: bool):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.refresh = refresh
+        self.status = 'queued'      # queued, running, done, cancelled, error
+        self.messages = 0
+        self.stream_time = None
+        self.duration = None
+        self.handle = None
+        self.error = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.preview_time = time.monotonic()    # the partial chat is shown PARTIAL_PREVIEW_SECONDS after the start
+        self.preview_messages = 0
+        self.key = cacheKey(url) or url
+        self.tickets = {self.id}    # one per submit sharing the job, it is cancelled when none is left
+
+    def progress(self, messages: int, stream_time, duration):
+        self.messages = messages
+        self.stream_time = stream_time
+        self.duration = duration
+        return not self.cancel_event.is_set()
+
+    def describe(self):
+        # one line status for the dashboard
+        text = self.status + ", " + f"{self.messages:,}" + " messages"
+        if self.stream_time is not None:
+            text += ", " + formatTimestamps([self.stream_time])[0][0]
+            if self.duration:
+                text += " / " + formatTimestamps([self.duration])[0][0] + " (" + f"{min(self.stream_time / self.duration, 1) * 100:.0f}" + "%)"
+        if self.error:
+            text += ", " + self.error
+        return text
+
+class FetchJobs:
+
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chad-fetch")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, url: str, refresh: bool = False):
+        # sessions asking for a video already queued or running share its job, returns a ticket for it
+        job = FetchJob(url, refresh)
+        with self.lock:
+            now = time.time()
+            for job_id in [i for i, j in self.jobs.items() if j.finished and now - j.finished > FETCH_JOB_TTL]:
+                del self.jobs[job_id]
+            for running in self.jobs.values():
+                if running.key == job.key and running.finished is None and not running.cancel_event.is_set():
+                    running.tickets.add(job.id)
+                    self.jobs[job.id] = running
+                    return job.id
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job)
+        return job.id
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        # the download stops once every session sharing it cancelled
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.tickets.discard(job_id)
+                if len(job.tickets) == 0:
+                    job.cancel_event.set()
+        return job
+
+    def running(self):
+        with self.lock:
+            return len({job.id for job in self.jobs.values() if job.finished is None})
+
+    def run(self, job):
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+            job.finished = time.time()
+            return
+
+        job.status = 'running'
+        try:
+            # the title comes with the chat, looked up apart only when the download has none
+            df = loadChat_cached(job.url, refresh=job.refresh, progress=job.progress)
+            if not df.attrs.get('title'):
+                df.attrs['title'] = getTitle(job.url)
+            job.handle = DATASETS.put(job.url, df)
+            DATASETS.discard(previewHandle(job.key))
+            job.messages = len(df)
+            job.status = 'done'
+        except FetchCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'error'
+            job.error = str(e)
+            print("fetch of " + job.url + " failed: " + str(e))
+        job.finished = time.time()
+
+FETCH_JOBS = FetchJobs(FETCH_WORKERS)
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Live mode, an ongoing stream is tailed and its activity counts are updated
+# incrementally from each new batch of messages
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+LIVE_BIN_WIDTH = 10         # seconds per bar in live mode
+LIVE_BATCH_SIZE = 256       # messages are processed in batches of this size, or every LIVE_BATCH_DELAY
+LIVE_BATCH_DELAY = 1.0
+LIVE_INTERVAL_MS = 5000     # how often the dashboard asks for new bins
+LIVE_SNAPSHOT_AGE = 10      # the table/zoom snapshot of the messages is rebuilt at most this often
+LIVE_KEYWORDS = 8           # keyword count arrays kept up to date per live chat
+
+def growCounts(counts, size: int):
+    # grow a count array to at least size, doubling so appends stay amortized O(1)
+    if size <= len(counts):
+        return counts
+    grown = np.zeros(max(size, 2 * len(counts)), dtype=counts.dtype)
+    grown[:len(counts)] = counts
+    return grown
+
+def liveHandle(url: str):
+    # one live chat per stream, by video id or else by the normalized channel url (youtube.com/@name/live)
+    key = cacheKey(url)
+    if key is None:
+        host, _, path = re.sub(r"^(https?://)?(www\.|m\.)?", "", url.strip(), flags=re.IGNORECASE).rstrip("/").partition("/")
+        normalized = host.lower() + "/" + path
+        key = re.sub(r"[^A-Za-z0-9_-]", "_", normalized)[:64] + "_" + hashlib.sha1(normalized.encode()).hexdigest()[:8]
+    return "live_" + key
+
+class LiveChat:
+
+    def __init__(self, url: str):
+        self.url = url
+        self.handle = liveHandle(url)
+        self.title = None
+        self.status = 'starting'
+        self.error = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        self.pending = deque()      # (timestamp, user, message) received but not processed yet, appended without the lock
+        self.last_batch = time.monotonic()
+        self.start_ts = None        # first message, in whole UNIX seconds
+        self.batches = []           # processed batches of (seconds, user, message) arrays
+        self.count = 0
+        self.last_second = 0
+        self.counts = np.zeros(3600, dtype=np.int64)
+        self.keyword_counts = OrderedDict()
+
+        self.snapshot = None
+        self.snapshot_time = 0
+        self.snapshot_count = -1
+
+        self.thread = threading.Thread(target=self.run, name="chad-live", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            chat = ChatDownloader().get_chat(self.url)
+            self.title = getattr(chat, 'title', None)
+            self.status = 'live'
+            for message in chat:
+                if self.stop_event.is_set():
+                    break
+                self.pending.append((message.get("timestamp"), message.get("author").get("name"), message.get("message")))
+                if len(self.pending) >= LIVE_BATCH_SIZE or time.monotonic() - self.last_batch >= LIVE_BATCH_DELAY:
+                    self.process()
+            self.status = 'stopped'
+        except Exception as e:
+            self.status = 'error'
+            self.error = str(e)
+            print("live chat of " + self.url + " failed: " + str(e))
+        self.process()
+
+    def process(self):
+        # turn the pending messages into a batch, only the new batch is counted
+        with self.lock:
+            self.last_batch = time.monotonic()
+            # only the messages there now, the ones appended meanwhile wait for the next batch
+            pending = [self.pending.popleft() for _ in range(len(self.pending))]
+            if len(pending) == 0:
+                return
+
+            timestamp = np.fromiter((p[0] for p in pending), dtype=np.int64, count=len(pending)) // 1000000
+            if self.start_ts is None:
+                self.start_ts = int(timestamp[0])
+            seconds = np.maximum(timestamp - self.start_ts, 0)
+            user = np.array([p[1] for p in pending], dtype=object)
+            message = np.array([p[2] for p in pending], dtype=object)
+
+            self.batches.append((seconds, user, message))
+            self.count += len(pending)
+            self.last_second = max(self.last_second, int(seconds.max()))
+            self.counts = growCounts(self.counts, self.last_second + 1)
+            self.counts[:self.last_second + 1] += np.bincount(seconds, minlength=self.last_second + 1)
+
+            for keyword in self.keyword_counts:
+                self.keyword_counts[keyword] = self.countKeyword(keyword, self.keyword_counts[keyword], [self.batches[-1]])
+
+    def countKeyword(self, keyword: str, counts, batches):
+        # add the keyword matches of batches to counts
+        matcher = keywordMatcher(keyword)
+        counts = growCounts(counts, self.last_second + 1)
+        if matcher is None:
+            return counts
+        for seconds, user, message in batches:
+            mask, found = matcher.match(message)
+            if mask.any():
+                matched = seconds[mask]
+                counts[:matched.max() + 1] += np.bincount(matched)
+        return counts
+
+    def keywordCounts(self, keyword: str):
+        # per second keyword counts, the first request for a keyword counts the whole chat once
+        with self.lock:
+            counts = self.keyword_counts.get(keyword)
+            if counts is None:
+                counts = self.countKeyword(keyword, np.zeros(len(self.counts), dtype=np.int64), self.batches)
+                self.keyword_counts[keyword] = counts
+                while len(self.keyword_counts) > LIVE_KEYWORDS:
+                    self.keyword_counts.popitem(last=False)
+            self.keyword_counts.move_to_end(keyword)
+            return counts
+
+    def bins(self, keyword: str, first: int, width: int = LIVE_BIN_WIDTH):
+        # complete bins from first on: (bin starts in seconds, chat counts, keyword counts)
+        self.process()
+        complete = (self.last_second + 1) // width if self.status == 'live' else -(-(self.last_second + 1) // width)
+        if complete <= first:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        with self.lock:
+            chat = rebin(self.counts[first * width:complete * width], width)
+        keyword_counts = np.zeros_like(chat)
+        if keyword:
+            keyword_counts = rebin(growCounts(self.keywordCounts(keyword), complete * width)[first * width:complete * width], width)
+        return np.arange(first, complete, dtype=np.int64) * width, chat, keyword_counts
+
+    def frame(self):
+        # all the messages so far as a chat DataFrame
+        with self.lock:
+            batches = list(self.batches)
+        if len(batches) == 0:
+            return ChatColumns(1).to_dataframe()
+        seconds = np.concatenate([b[0] for b in batches])
+        df = compactChat(pd.DataFrame({'time': seconds // 60, 'timestamp': seconds, 'user': np.concatenate([b[1] for b in batches]), 'message': np.concatenate([b[2] for b in batches])}))
+        df.attrs['title'] = self.title
+        return df
+
+    def dataset(self):
+        # snapshot used by the table and zoom callbacks, rebuilt when stale
+        if self.snapshot is None or (self.count != self.snapshot_count and time.monotonic() - self.snapshot_time > LIVE_SNAPSHOT_AGE):
+            count = self.count
+            self.snapshot = ChatDataset(self.handle, self.url, self.frame(), indexed=False)
+            QUERY_CACHE.invalidate(self.handle)
+            self.snapshot_time = time.monotonic()
+            self.snapshot_count = count
+        return self.snapshot
+
+    def stop(self):
+        self.stop_event.set()
+
+    def describe(self):
+        return self.status + ", " + f"{self.count:,}" + " messages, " + formatTimestamps([self.last_second])[0][0] + (", " + self.error if self.error else "")
+
+class LiveChats:
+
+    def __init__(self):
+        self.chats = {}
+        self.lock = threading.Lock()
+
+    def start(self, url: str):
+        # sessions watching the same stream share one live chat
+        with self.lock:
+            handle = liveHandle(url)
+            live = self.chats.get(handle)
+            if live is None or live.status in ('stopped', 'error'):
+                live = LiveChat(url)
+                self.chats[live.handle] = live
+            return live
+
+    def get(self, handle: str):
+        with self.lock:
+            return self.chats.get(handle)
+
+    def stop(self, handle: str):
+        # stop tailing, the messages so far become a regular dataset, cached when the url names one video
+        with self.lock:
+            live = self.chats.pop(handle, None)
+        if live is None:
+            return None
+        live.stop()
+        live.process()
+
+        df = live.frame()
+        key = cacheKey(live.url)
+        if key is not None and len(df) > 0:
+            cacheWrite(key, live.url, df)
+        return DATASETS.put(live.url, df)
+
+LIVE_CHATS = LiveChats()
+
+def liveFigure(live, keyword: str):
+    # full live figure, update_live then only extends it with the new bins
+    bins, chat, keyword_counts = live.bins(keyword, 0)
+    fig = go.Figure(data=liveTraces(live, bins, chat, keyword_counts))
+    fig.update_layout(
+        barmode='overlay',  # Ensure histograms overlap
+        title_text=(live.title or live.url) + " (live)",
+        xaxis_title_text='Time (minutes)',
+        yaxis_title_text='Count',
+        uirevision=live.handle,
+    )
+    return fig, len(bins)
+
+def liveTraces(live, bins, chat, keyword_counts):
+    per = binLabel(LIVE_BIN_WIDTH)
+    trace0 = activityTrace('bars', bins, chat + keyword_counts, LIVE_BIN_WIDTH, None, 'Combined Activity', 'red')
+    trace1 = activityTrace('bars', bins, chat, LIVE_BIN_WIDTH, None, 'Chat Activity', 'green',
+                           hovertemplate="<b>Time:</b> %{x}<br><b>Chats Per " + per + ":</b> %{y}<br>Click to open the VOD here<extra></extra>")
+    trace2 = activityTrace('bars', bins, keyword_counts, LIVE_BIN_WIDTH, None, 'Keyword Activity', 'blue')
+    return [trace0, trace1, trace2]
 
-    # get the platform
-    if "youtube" in url:
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Processing functions used to process the data
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+def parseVideoUrl(url: str):
+    # return (platform, video id, timestamp url prefix) for a youtube/twitch url, None otherwise
+    if url is None:
+        return None
+
+    if "youtube" in url or "youtu.be" in url:
         # https://www.youtube.com/watch?v=yFG5AJ38p6U
         # get the video id
-        vidId = url.split("=")[-1]
+        if "v=" in url:
+            vidId = url.split("v=")[-1].split("&")[0]
+        else:
+            vidId = url.split("?")[0].rstrip("/").split("/")[-1]
 
         # https://youtu.be/yFG5AJ38p6U?t=2127
         tsurl = "https://youtu.be/" + vidId + "?t="
-        platform = "youtube"
+        return "youtube", vidId, tsurl
     elif "twitch" in url:
-        vidId = url.split("/")[-1]
+        vidId = url.split("?")[0].rstrip("/").split("/")[-1]
         # https://www.twitch.tv/videos/2139118880?t=04h21m03s
         tsurl = "https://www.twitch.tv/videos/" + vidId + "?t="
-        platform = "twitch"
+        return "twitch", vidId, tsurl
+    return None
+
+TWO_DIGITS = np.array(["%02d" % i for i in range(60)], dtype=object)
+
+def formatTimestamps(seconds):
+    # H:MM:SS strings for a whole column of second offsets, hours keep counting past 24
+    # returns (timestamps, hours, minutes, seconds) string columns
+    s = np.asarray(seconds, dtype=np.float64).astype(np.int64)
+    h, rem = np.divmod(s, 3600)
+    m, sec = np.divmod(rem, 60)
+    hours = h.astype(str).astype(object)
+    return hours + ":" + TWO_DIGITS[m] + ":" + TWO_DIGITS[sec], hours, TWO_DIGITS[m], TWO_DIGITS[sec]
+
+def timestampUrls(url, seconds):
+    # (H:MM:SS, url at that time) columns for a youtube/twitch url, None if the platform is unknown
+    video = parseVideoUrl(url)
+    if video is None:
+        return None
+    platform, vidId, tsurl = video
+
+    # a chat has far fewer distinct seconds than messages, only format each second once
+    s = np.asarray(seconds, dtype=np.float64).astype(np.int64)
+    uniq, inverse = np.unique(s, return_inverse=True)
+
+    timestamps, hours, minutes, secs = formatTimestamps(uniq)
+    if platform == "youtube":
+        # https://youtu.be/yFG5AJ38p6U?t=2127
+        urls = tsurl + uniq.astype(str).astype(object)
     else:
-        return
-    
-    dff = pd.DataFrame(columns=['time', 'user', 'message', 'url'])
+        # https://www.twitch.tv/videos/2139118880?t=4h21m03s
+        urls = tsurl + hours + "h" + minutes + "m" + secs + "s"
+    return timestamps[inverse], urls[inverse]
 
-    for index, row in df.iterrows():
-        # convert the timestamp to a string HH:mm:ss
-        timestamp = str(datetime.timedelta(seconds=row['timestamp'])).split(".")[0]
-
-        if platform == "youtube":
-            tsurlts = tsurl + str(int(row['timestamp']))
-        elif platform == "twitch":
-            tsurlts = tsurl + timestamp.split(":")[0] + "h" + timestamp.split(":")[1] + "m" + timestamp.split(":")[2] + "s"
+def printChat_withURL(url, df):#
+    # print the chat messages with the URL+timestamp
+    print("Chat Messages from " + url)
 
-        dff.loc[len(dff), ['time', 'user','message', 'url']] = timestamp, row['user'], row['message'], tsurlts
-    
+    columns = timestampUrls(url, df['timestamp'].to_numpy())
+    if columns is None:
+        return
+    timestamps, urls = columns
 
-    dff['url'] = dff['url'].apply(lambda x: f"[Click Here]({x})")
+    dff = pd.DataFrame({'time': timestamps, 'user': df['user'].to_numpy(), 'message': df['message'].to_numpy(), 'url': "[Click Here](" + urls + ")"})
     return dff
 
 def printChat(df):
     print(tabulate(df, headers='keys', tablefmt='plain', stralign='left', numalign='left'))
     return;
 
+@timedStage
 def addUrlToChat(url, df):
 
-    if "youtube" in url:
-        # https://www.youtube.com/watch?v=yFG5AJ38p6U
-        # get the video id
-        vidId = url.split("=")[-1]
-
-        # https://youtu.be/yFG5AJ38p6U?t=2127
-        tsurl = "https://youtu.be/" + vidId + "?t="
-        platform = "youtube"
-    elif "twitch" in url:
-        vidId = url.split("/")[-1]
-        # https://www.twitch.tv/videos/2139118880?t=04h21m03s
-        tsurl = "https://www.twitch.tv/videos/" + vidId + "?t="
-        platform = "twitch"
-    else:
+    columns = timestampUrls(url, df['timestamp'].to_numpy())
+    if columns is None:
         return
-    
-    # add the url with timestamp to the dataframe
-    for index, row in df.iterrows():
-        # convert the timestamp to a string HH:mm:ss
-        timestamp = str(datetime.timedelta(seconds=row['timestamp'])).split(".")[0]
-
-        if platform == "youtube":
-            tsurlts = tsurl + str(int(row['timestamp']))
-        elif platform == "twitch":
-            tsurlts = tsurl + timestamp.split(":")[0] + "h" + timestamp.split(":")[1] + "m" + timestamp.split(":")[2] + "s"
-
-        df.loc[index, 'timestamps'] = timestamp
-        df.loc[index, 'url'] = tsurlts
+    timestamps, urls = columns
 
+    # add the url with timestamp to the dataframe
+    df['timestamps'] = timestamps
+    df['url'] = urls
     return df;
 
 # ------------------------  ------------------------  ------------------------
@@ -313,75 +1880,596 @@ def addUrlToChat(url, df):
 # ------------ ------------------------  ------------------------ ------------
 # ------------------------  ------------------------  ------------------------
 
-def filter_data(df, start: str, end: str, keyword: str, user: str):
-    df['keywordFound'] = None
-    if keyword and len(keyword) > 0:
-        df = df[df['message'].str.contains(keyword, case=False, regex=True)]
-        df['keywordFound'] = df['message'].str.extract("(" + "|".join(keyword) + ")", flags=re.IGNORECASE)
-    if user and len(user) > 0:
-        df = df[df['user'].str.contains("^(" + user + ")$", case=False)]
+def parseKeywords(keyword):
+    # "lol, lmao|kekw" or ["lol", "lmao"] -> ('lol', 'lmao', 'kekw'), "re:<pattern>" is kept as a raw regex
+    if keyword is None:
+        return ()
+    if isinstance(keyword, str):
+        keyword = [keyword]
+
+    terms = []
+    seen = set()
+    for kw in keyword:
+        if kw.startswith("re:"):
+            parts = [kw]
+        else:
+            parts = re.split(r"[,|]", kw)
+        for part in parts:
+            part = part.strip()
+            if len(part) > 0 and part.lower() not in seen:
+                seen.add(part.lower())
+                terms.append(part)
+    return tuple(terms)
+
+class QueryError(ValueError):
+    # a keyword or user query that cannot run (an invalid re: pattern), reported to the user instead of failing
+    pass
+
+def checkRegex(term: str):
+    # compiled pattern of a re:<pattern> term, QueryError with the reason when it is invalid
+    # compiled alone first so the error positions are those of the pattern typed, then as it is used in an alternation
+    try:
+        re.compile(term[3:])
+        return re.compile('(?:' + term[3:] + ')', re.IGNORECASE)
+    except re.error as e:
+        raise QueryError("invalid regex " + term + ": " + str(e))
+
+WORD_TERM = re.compile(r"^\w+$")
+PREFIX_TERM = re.compile(r"^\w+\*$")
+
+def trieRegex(terms):
+    # single alternation with the common prefixes factored out, "lol|lolol|lmao" -> l(?:mao|ol(?:ol)?)
+    # so the regex engine never retries the same prefix for every keyword
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != '']
+        if len(alts) == 0:
+            return ''
+        body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+class KeywordMatcher:
+    # compiled keyword query, one pass over the messages gives the match mask and the keyword found
+    #   lol     whole word, answered from the token index when there is one
+    #   lol*    word starting with lol, also answered from the token index
+    #   :) / a b  anything else is matched as a literal anywhere in the message
+    #   re:...  raw regex
+    # a message with several keywords is reported under its leftmost match, with or without the token index
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.words = [t for t in terms if WORD_TERM.match(t)]
+        self.prefixes = [t for t in terms if PREFIX_TERM.match(t)]
+        self.literals = [t for t in terms if not t.startswith("re:") and t not in self.words and t not in self.prefixes]
+        self.regexes = [t for t in terms if t.startswith("re:")]
+        for t in self.regexes:
+            checkRegex(t)
+
+        # keyword reported for a matched text, longest prefix first
+        self.canonical = {t.lower(): t for t in self.words + self.literals}
+        self.prefix_lookup = sorted([(t[:-1].lower(), t) for t in self.prefixes], key=lambda p: -len(p[0]))
+
+        self.pattern = self.compile(self.words, self.prefixes, self.literals, self.regexes)
+        self.unindexed = self.compile([], [], self.literals, self.regexes)
+
+    def compile(self, words, prefixes, literals, regexes):
+        alts = []
+        if words:
+            alts.append(r"(?<!\w)" + trieRegex([t.lower() for t in words]) + r"(?!\w)")
+        if prefixes:
+            alts.append(r"(?<!\w)" + trieRegex([t[:-1].lower() for t in prefixes]) + r"\w*")
+        if literals:
+            alts.append(trieRegex([t.lower() for t in literals]))
+        alts += ['(?:' + t[3:] + ')' for t in regexes]
+        if len(alts) == 0:
+            return None
+        return re.compile('|'.join(alts), re.IGNORECASE)
+
+    def keywordOf(self, text: str):
+        low = text.lower()
+        term = self.canonical.get(low)
+        if term is not None:
+            return term
+        for prefix, term in self.prefix_lookup:
+            if low.startswith(prefix):
+                return term
+        return text
+
+    def scan(self, pattern, messages, mask, found):
+        search = pattern.search
+        keywordOf = self.keywordOf
+        for i, message in enumerate(messages):
+            if mask[i] or message.__class__ is not str:
+                continue
+            m = search(message)
+            if m is not None:
+                mask[i] = True
+                found[i] = keywordOf(m.group(0))
+
+    def leftmost(self, positions, messages, found):
+        # keyword of the leftmost match of the messages at positions, as scan reports it
+        search = self.pattern.search
+        keywordOf = self.keywordOf
+        for i in positions:
+            m = search(messages[i])
+            if m is not None:
+                found[i] = keywordOf(m.group(0))
+
+    def match(self, messages, rows=None, index=None):
+        # messages are the candidates, rows their positions in the indexed chat when an index is given
+        found = np.empty(len(messages), dtype=object)
+        mask = np.zeros(len(messages), dtype=bool)
+
+        if index is None or rows is None:
+            self.scan(self.pattern, messages, mask, found)
+            return mask, found
+
+        # words and prefixes come from the posting lists, a message hit by a single keyword is reported under it
+        # the others (several keywords, or literal and regex terms that could match too) are searched for the leftmost
+        indexed = self.words + self.prefixes
+        if indexed:
+            code = np.zeros(index.nrows, dtype=np.int32)
+            count = np.zeros(index.nrows, dtype=np.int32)
+            for i, term in enumerate(indexed):
+                postings = np.unique(index.prefix(term[:-1].lower())) if term.endswith("*") else index.word(term.lower())
+                code[postings] = i + 1
+                count[postings] += 1
+            hit = code[rows]
+            mask = hit > 0
+            found[mask] = np.array(indexed, dtype=object)[hit[mask] - 1]
+            self.leftmost(np.flatnonzero(mask if self.unindexed is not None else count[rows] > 1), messages, found)
+
+        if self.unindexed is not None:
+            self.scan(self.unindexed, messages, mask, found)
+        return mask, found
+
+@functools.lru_cache(maxsize=64)
+def compileKeywords(terms):
+    return KeywordMatcher(terms)
+
+def keywordMatcher(keyword):
+    # cached matcher for a keyword query, None if there is nothing to search for
+    terms = parseKeywords(keyword)
+    if len(terms) == 0:
+        return None
+    return compileKeywords(terms)
+
+def keywordCodes(keyword, found):
+    # (terms of the query, index of the term each match was found with), (None, None) without a query
+    # regex matches report the matched text, they are counted under the first regex
+    matcher = keywordMatcher(keyword)
+    if matcher is None:
+        return None, None
+    terms = list(matcher.terms)
+    lookup = {t: i for i, t in enumerate(terms)}
+    other = lookup[matcher.regexes[0]] if matcher.regexes else 0
+    codes = pd.Series(found, dtype=object).map(lookup).fillna(other).to_numpy().astype(np.int64)
+    return terms, codes
+
+class TokenIndex:
+    # inverted index of the chat, lowercased \w+ token -> row positions of the messages containing it
+    # tokens are sorted so prefix queries are a range of tokens, the postings of token i
+    # are rows[offsets[i]:offsets[i+1]]
+
+    def __init__(self, tokens, offsets, rows, nrows: int):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.rows = rows
+        self.nrows = nrows
+        self.nbytes = offsets.nbytes + rows.nbytes + sum(len(t) + 49 for t in tokens)
+
+    @staticmethod
+    @timedStage
+    def build(messages):
+        n = len(messages)
+        lists = pd.Series(messages, dtype=object).fillna("").astype(str).str.lower().str.findall(r"\w+")
+        lengths = lists.str.len().to_numpy().astype(np.int64)
+        rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+        tokens = np.fromiter(itertools.chain.from_iterable(lists[lengths > 0]), dtype=object, count=int(lengths.sum()))
+
+        # number the tokens in sorted order, then sort and dedup (token, row) pairs in one go
+        codes, uniques = pd.factorize(tokens)
+        # sorted as python strings, a fixed width unicode copy would take n_unique * longest token * 4 bytes
+        sorter = pd.Index(uniques).argsort()
+        rank = np.empty(len(uniques), dtype=np.int64)
+        rank[sorter] = np.arange(len(uniques))
+        pairs = np.unique(rank[codes] * max(n, 1) + rows)
+
+        token_codes = pairs // max(n, 1)
+        offsets = np.searchsorted(token_codes, np.arange(len(uniques) + 1))
+        return TokenIndex(list(uniques[sorter]), offsets.astype(np.int64), (pairs % max(n, 1)).astype(np.int32), n)
+
+    def word(self, token: str):
+        i = bisect.bisect_left(self.tokens, token)
+        if i < len(self.tokens) and self.tokens[i] == token:
+            return self.rows[self.offsets[i]:self.offsets[i + 1]]
+        return self.rows[:0]
+
+    def prefix(self, prefix: str):
+        i0 = bisect.bisect_left(self.tokens, prefix)
+        i1 = bisect.bisect_left(self.tokens, prefix + "\U0010ffff")
+        return self.rows[self.offsets[i0]:self.offsets[i1]]
+
+    def save(self, path: str):
+        blob = np.frombuffer("\n".join(self.tokens).encode("utf-8"), dtype=np.uint8)
+        np.savez(path, tokens=blob, offsets=self.offsets, rows=self.rows, nrows=np.int64(self.nrows))
+
+    @staticmethod
+    def load(path: str):
+        data = np.load(path)
+        blob = data['tokens'].tobytes().decode("utf-8")
+        tokens = blob.split("\n") if len(blob) > 0 else []
+        return TokenIndex(tokens, data['offsets'], data['rows'], int(data['nrows']))
+
+class UserIndex:
+    # case folded user name -> row positions of their messages, like the TokenIndex the names are sorted and the
+    # rows of name i are rows[offsets[i]:offsets[i+1]], in row (so time) order
+    # counts, first and last are the messages of every user and the offsets of their first and last one,
+    # codes is the name of every row (-1 without a name) for the counts of a time range
+
+    def __init__(self, names, display, offsets, rows, codes, timestamps):
+        self.names = names
+        self.display = display
+        self.lookup = {name: i for i, name in enumerate(names)}
+        self.offsets = offsets
+        self.rows = rows
+        self.codes = codes
+        self.nrows = len(codes)
+        self.counts = np.diff(offsets)
+        has = self.counts > 0
+        self.first = np.full(len(names), -1, dtype=np.int64)
+        self.last = np.full(len(names), -1, dtype=np.int64)
+        self.first[has] = timestamps[rows[offsets[:-1][has]]]
+        self.last[has] = timestamps[rows[offsets[1:][has] - 1]]
+        self.nbytes = offsets.nbytes + rows.nbytes + codes.nbytes + self.first.nbytes + self.last.nbytes + sum(len(n) + 49 for n in names) * 3
+
+    @staticmethod
+    @timedStage
+    def build(users, timestamps):
+        # users is the user column of a chat sorted by time, a categorical only costs one pass over its int codes
+        users = pd.Series(users)
+        if not isinstance(users.dtype, pd.CategoricalDtype):
+            users = users.astype('category')
+        categories = np.asarray(users.cat.categories.astype(str), dtype=object)
+        names, fold = np.unique(np.asarray(pd.Series(categories, dtype=object).str.casefold(), dtype=object), return_inverse=True)
+
+        # one displayed name per folded name, the first spelling in category order
+        display = np.empty(len(names), dtype=object)
+        display[fold[::-1]] = categories[::-1]
+
+        # category code -> folded name id, the extra last slot maps the missing names (code -1) to -1
+        codes = np.append(fold, -1).astype(np.int32)[users.cat.codes.to_numpy()]
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        rows = order[np.count_nonzero(codes < 0):]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(names)))]).astype(np.int64)
+        return UserIndex(names, display, offsets, rows, codes, np.asarray(timestamps))
+
+    def ids(self, names, patterns=()):
+        # ids of the exact (case folded) names, and of the names matched by the regexes
+        ids = [self.lookup[n] for n in names if n in self.lookup]
+        for pattern in patterns:
+            ids += [i for i, name in enumerate(self.display) if pattern.fullmatch(name) or pattern.fullmatch(self.names[i])]
+        return sorted(set(ids))
+
+    def rows_of(self, ids):
+        # sorted row positions of the messages of these users
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in ids]))
+
+    def top(self, i0: int, i1: int, timestamps, k: int = 10):
+        # the k users with the most messages in rows [i0, i1): (name, messages, first, last offset in that range)
+        if i0 <= 0 and i1 >= self.nrows:
+            counts = self.counts
+        else:
+            codes = self.codes[i0:i1]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.names))
+        k = min(k, int(np.count_nonzero(counts)))
+        if k <= 0:
+            return []
+        best = np.argpartition(-counts, k - 1)[:k]
+        best = best[np.lexsort((best, -counts[best]))]
+
+        top = []
+        for i in best:
+            rows = self.rows[self.offsets[i]:self.offsets[i + 1]]
+            lo, hi = np.searchsorted(rows, i0), np.searchsorted(rows, i1)
+            top.append((self.display[i], int(counts[i]), int(timestamps[rows[lo]]), int(timestamps[rows[hi - 1]])))
+        return top
+
+BIN_MAX_BARS = 20000   # a chosen bin width giving more bars than this falls back to the automatic width
+KEYWORD_COLORS = ['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A', '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
+RENDER_PIXELS = 1500    # graph width assumed until the browser reports it
+RENDER_OVERSAMPLE = 8   # webgl lines use up to this many bins per pixel before the min/max downsampling
+
+def minMaxDownsample(bins, counts, pixels: int):
+    # keep the lowest and the highest bin of every pixel column, spikes survive and the order is kept
+    n = len(bins)
+    if not pixels or n <= 2 * pixels:
+        return bins, counts
+    size = -(-n // int(pixels))
+    columns = -(-n // size)
+    pad = columns * size - n
+    values = np.asarray(counts, dtype=np.float64)
+    first = np.arange(columns) * size
+    lo = first + np.concatenate([values, np.full(pad, np.inf)]).reshape(columns, size).argmin(axis=1)
+    hi = first + np.concatenate([values, np.full(pad, -np.inf)]).reshape(columns, size).argmax(axis=1)
+    keep = np.unique(np.concatenate([lo, hi]))
+    return bins[keep], counts[keep]
+
+def activityTrace(render: str, bins, counts, width: int, pixels: int, name: str, color: str, **kwargs):
+    # one series of the activity graph, x is the bin start in minutes so a click gives the time to open
+    if render == 'webgl':
+        bins, counts = minMaxDownsample(bins, counts, pixels)
+        return go.Scattergl(x=bins / 60, y=counts, mode='lines', line_shape='hv', name=name, line_color=color, **kwargs)
+    return go.Bar(x=bins / 60, y=counts, width=width / 60, offset=0, name=name, marker_color=color, **kwargs)
+
+def patchTrace(figure, i: int, trace):
+    # replace the points of trace i of a dash.Patch of the figure
+    figure['data'][i]['x'] = trace.x
+    figure['data'][i]['y'] = trace.y
+    if isinstance(trace, go.Bar):
+        figure['data'][i]['width'] = trace.width
+    if trace.hovertemplate is not None:
+        figure['data'][i]['hovertemplate'] = trace.hovertemplate
+
+@timedStage
+def activityTraces(dataset, keyword: str, user: str, start_s: float, end_s: float, width: int = None, smooth: int = 0, split: bool = False,
+                   render: str = 'bars', pixels: int = None):
+    # memoized buildActivityTraces, zooming back to a view or a second callback for the same change is a cache hit
+    params = (queryTerms(keyword), queryUsers(user), queryTime(start_s), queryTime(end_s), int(width or 0), int(smooth or 0), bool(split),
+              render or 'bars', int(pixels or 0))
+    return QUERY_CACHE.get(dataset, 'activity', params,
+                           lambda: buildActivityTraces(dataset, keyword, user, start_s, end_s, width, smooth, split, render, pixels))
+
+def buildActivityTraces(dataset, keyword: str, user: str, start_s: float, end_s: float, width: int = None, smooth: int = 0, split: bool = False,
+                        render: str = 'bars', pixels: int = None):
+    # traces for the chat/keyword activity in [start_s, end_s), the bin width follows the span unless given
+    # smooth is a moving average over that many bins, split adds one trace per keyword of the query after the 3 usual ones
+    # render 'webgl' draws lines with finer bins, min/max downsampled to pixels points per series
+    if width and (end_s - start_s) / width > BIN_MAX_BARS:
+        width = None
+    pixels = pixels or RENDER_PIXELS
+    if not width and render == 'webgl':
+        width = dataset.pyramid.width_for(start_s, end_s, pixels * RENDER_OVERSAMPLE)
+    width, bins, chat = dataset.pyramid.query(start_s, end_s, width)
+    keyword_counts = np.zeros_like(chat)
+    per_key = None
+    if keyword is not None and len(keyword) > 0:
+        pyramid = dataset.keywordPyramid(keyword, user)
+        per_key = pyramid.query(start_s, end_s, width, per_key=True)[2]
+        keyword_counts = per_key.sum(axis=0)
+    chat = smoothCounts(chat, smooth)
+    keyword_counts = smoothCounts(keyword_counts, smooth)
+
+    per = binLabel(width)
+    trace0 = activityTrace(render, bins, chat + keyword_counts, width, pixels, 'Combined Activity', 'red')
+    trace1 = activityTrace(render, bins, chat, width, pixels, 'Chat Activity', 'green',
+                           hovertemplate="<b>Time:</b> %{x}<br><b>Chats Per " + per + ":</b> %{y}<br>Click to open the VOD here<extra></extra>")
+    trace2 = activityTrace(render, bins, keyword_counts, width, pixels, 'Keyword Activity', 'blue')
+    traces = [trace0, trace1, trace2]
+
+    if split and per_key is not None and pyramid.keys is not None:
+        trace2.visible = 'legendonly'
+        per_key = smoothCounts(per_key, smooth)
+        for i, term in enumerate(pyramid.keys):
+            traces.append(activityTrace(render, bins, per_key[i], width, pixels, term, KEYWORD_COLORS[i % len(KEYWORD_COLORS)]))
+    return width, traces
+
+def userQuery(user):
+    # "name, other|third" -> (case folded exact names, regexes matching a whole name), "re:<pattern>" is a regex
+    # an invalid pattern is a QueryError, like in a keyword query
+    terms = parseKeywords(user)
+    names = [t.casefold() for t in terms if not t.startswith("re:")]
+    patterns = [checkRegex(t) for t in terms if t.startswith("re:")]
+    return names, patterns
+
+def userMask(df, user: str, users=None):
+    # rows of df written by one of the users of the query, case insensitive
+    # users is the UserIndex of the full chat, df must then be that chat or a slice of it
+    names, patterns = userQuery(user)
+    if users is not None:
+        full = np.zeros(users.nrows, dtype=bool)
+        full[users.rows_of(users.ids(names, patterns))] = True
+        return full[df.index.to_numpy()]
+
+    # without an index, the names are compared once per distinct user of a categorical
+    column = df['user']
+    codes = None
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.codes.to_numpy()
+        column = pd.Series(column.cat.categories.astype(str))
+    column = column.fillna('').astype(str)
+    match = column.str.casefold().isin(names).to_numpy()
+    for pattern in patterns:
+        match |= column.map(lambda name: pattern.fullmatch(name) is not None).to_numpy(dtype=bool)
+    if codes is None:
+        return match
+    return np.append(match, False)[codes]
+
+@timedStage
+def filter_data(df, start: str, end: str, keyword: str, user: str, index=None, users=None):
+    # the time and user filters are applied first and always produce a new frame,
+    # the input df is shared between sessions and must not be modified
+    # index/users are the TokenIndex/UserIndex of the full chat, df must then be that chat or a slice of it
+    mask = np.ones(len(df), dtype=bool)
     if start:
-        df = df[(df['time'] >= int(start))]
+        mask &= (df['time'] >= int(start)).to_numpy()
     if end:
-        df = df[(df['time'] <= int(end))]
+        mask &= (df['time'] <= int(end)).to_numpy()
+    if user and len(user) > 0:
+        mask &= userMask(df, user, users)
+    df = df[mask]
+
+    df['keywordFound'] = None
+    if keyword and len(keyword) > 0:
+        matcher = keywordMatcher(keyword)
+        if matcher is not None:
+            mask, found = matcher.match(df['message'].to_numpy(), df.index.to_numpy(), index)
+            df = df[mask]
+            df['keywordFound'] = found[mask]
     return df
 
-@dasher.callback(
-    [Output('zoom-level-info', 'children'), Output('table-div', 'children', allow_duplicate=True)],
+def callbackName():
+    # name of the python function behind a /_dash-update-component request
+    body = flask.request.get_json(silent=True) or {}
+    entry = dasher.callback_map.get(body.get('output'))
+    return entry['callback'].__name__ if entry is not None else 'unknown'
+
+@serverHook('before_request')
+def metrics_before_request():
+    if not flask.request.path.endswith('/_dash-update-component'):
+        return
+    flask.g.chad_callback = callbackName()
+    if PROFILE_DIR and (not PROFILE_CALLBACKS or flask.g.chad_callback in PROFILE_CALLBACKS):
+        flask.g.chad_profile = cProfile.Profile()
+        flask.g.chad_profile.enable()
+    flask.g.chad_t0 = time.perf_counter()
+
+def metricsProfileDump(name: str):
+    profile = flask.g.pop('chad_profile', None)
+    if profile is None:
+        return
+    profile.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile.dump_stats(os.path.join(PROFILE_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f") + "_" + name + ".prof"))
+
+@serverHook('after_request')
+def metrics_after_request(response):
+    t0 = flask.g.pop('chad_t0', None)
+    if t0 is None:
+        return response
+    name = flask.g.chad_callback
+    METRICS.observe('chad_callback_seconds', name, time.perf_counter() - t0, METRICS_BUCKETS)
+    if response.status_code >= 500:
+        METRICS.count('chad_callback_errors_total', name)
+    else:
+        METRICS.observe('chad_callback_response_bytes', name, len(response.get_data()))
+    metricsProfileDump(name)
+    return response
+
+@serverHook('teardown_request')
+def metrics_teardown_request(exc):
+    # after_request is skipped when the callback raised
+    if flask.g.pop('chad_t0', None) is not None:
+        METRICS.count('chad_callback_errors_total', flask.g.chad_callback)
+        metricsProfileDump(flask.g.chad_callback)
+
+@serverHook('route', '/metrics')
+def metrics():
+    running = FETCH_JOBS.running()
+    with LIVE_CHATS.lock:
+        live = sum(1 for chat in LIVE_CHATS.chats.values() if chat.status not in ('stopped', 'error'))
+    gauges = [
+        ('chad_datasets', "Chats loaded in memory", len(DATASETS.datasets)),
+        ('chad_datasets_bytes', "Memory used by the loaded chats and their indexes", DATASETS.nbytes()),
+        ('chad_fetch_jobs_running', "Downloads queued or running", running),
+        ('chad_live_chats', "Live chats being followed", live),
+        ('chad_query_cache_entries', "Query results in the query cache", len(QUERY_CACHE.entries)),
+        ('chad_query_cache_bytes', "Memory used by the query cache", QUERY_CACHE.nbytes),
+    ]
+    return flask.Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# the pixel width of the graph, for the downsampling of the webgl lines, relayoutData also fires on resize
+clientsideCallback(
+    """
+    function(relayoutData) {
+        var graph = document.getElementById('output-graph');
+        return graph && graph.clientWidth ? graph.clientWidth : window.innerWidth;
+    }
+    """,
+    Output('graph-width', 'data'),
+    Input('output-graph', 'relayoutData'),
+)
+
+@callback(
+    [Output('zoom-level-info', 'children'), Output('table-query', 'data', allow_duplicate=True), Output('output-graph', 'figure', allow_duplicate=True),
+     Output('figure-state', 'data', allow_duplicate=True)],
     Input('output-graph', 'relayoutData'),
     Input('store-data', 'data'),
-    [State('input-keyword', 'value'),
-     State('input-user', 'value')],
+    [State('figure-state', 'data'),
+     State('graph-width', 'data')],
     prevent_initial_call=True
 )
-def display_zoom_level(relayoutData, stored_data, keyword, user):
+@timedStage
+def display_zoom_level(relayoutData, stored_data, figure_state, pixels):
 
-    if stored_data is not None:
-        urlo = stored_data['url']
-        data_json = stored_data['data']
-        dfo = pd.read_json(data_json, orient='split')
+    dataset = getDataset(stored_data)
+    if dataset is None:
+        return "No data loaded.", None, dash.no_update, dash.no_update
 
-    x_range_start = dfo['time'].min()
-    x_range_end = dfo['time'].max()
+    # the view is redrawn with what update_output drew, not with the inputs edited since the last Run
+    drawn = figure_state if figure_state and figure_state.get('handle') == dataset.handle else {}
+    keyword, user = drawn.get('keyword'), drawn.get('user')
+    options = drawn.get('options', {})
+    bin_width = options.get('width')
+
+    x_range_start = 0
+    x_range_end = dataset.pyramid.duration / 60
+    zoomed = False
 
     if relayoutData:
         if 'xaxis.range[0]' in relayoutData and 'xaxis.range[1]' in relayoutData:
             x_range_start = relayoutData['xaxis.range[0]']
             x_range_end = relayoutData['xaxis.range[1]']
+            zoomed = True
+
+    if x_range_start is not None and x_range_end is not None:
+        start_s = max(x_range_start * 60, 0)
+        end_s = x_range_end * 60
+
+        # the figure is rebinned for the new view, update_output already draws it when the data changes
+        figure = dash.no_update
+        live = bool(stored_data.get('live'))
+        if dash.callback_context.triggered_id == 'output-graph' and (zoomed or 'xaxis.autorange' in relayoutData) and not live and drawn:
+            # keep one view width of bins on each side so panning does not show empty bars
+            span = end_s - start_s
+            view = [start_s - span, end_s + span]
+            pixels = (pixels or RENDER_PIXELS) * 3
+            try:
+                width, traces = activityTraces(dataset, keyword, user, view[0], view[1], bin_width, options.get('smooth'), options.get('split'),
+                                               options.get('render'), pixels)
+            except QueryError as e:
+                return str(e), None, dash.no_update, dash.no_update
+            figure = dash.Patch()
+            for i, trace in enumerate(traces):
+                patchTrace(figure, i, trace)
+            figure_state = dict(drawn, view=view, pixels=pixels)
+        else:
+            figure_state = dash.no_update
 
-    if stored_data is not None and x_range_start is not None and x_range_end is not None:
-
-        filtered_df3 = dfo
-        filtered_df3 = filter_data(dfo, x_range_start, x_range_end, keyword, user)
-        df3 = filtered_df3.groupby("time")["keywordFound"].count().reset_index(name="keyword_per_minute")
-
-        table = None
-        if filtered_df3 is not None:
-            filtered_df3 = addUrlToChat(urlo, filtered_df3)
-
-            filtered_df3['url'] = filtered_df3['url'].apply(lambda x: f"[Link]({x})")
-
-            filtered_df3 = filtered_df3[['time', 'timestamps', 'message', 'url']]
-
-            table = dash_table.DataTable(
-                data=filtered_df3.to_dict('records'),
-                columns=[{"name": i, "id": i, 'type': 'text', 'presentation': 'markdown'} if i == 'url' else {"name": i, "id": i} for i in filtered_df3.columns],
-                style_table={'overflowX': 'auto'},
-                style_cell={'textAlign': 'left'},
-                markdown_options={"html": True, "link_target": "_blank"}
-            )
-        return "Zoom or pan to update the view.", table
+        # the table only gets the query, its pages are materialised by update_table
+        table_query = {'url': dataset.url, 'handle': dataset.handle, 'live': live, 'start_s': start_s, 'end_s': end_s, 'keyword': keyword, 'user': user}
+        width = bin_width if bin_width and (end_s - start_s) / bin_width <= BIN_MAX_BARS else dataset.pyramid.width_for(start_s, end_s)
+        return "Zoom or pan to update the view, bins of " + binLabel(width) + ".", table_query, figure, figure_state
 
-    return "No zoom update detected.", None
+    return "No zoom update detected.", None, dash.no_update, dash.no_update
 
-@dasher.callback(
+@callback(
     Output('url-output', 'children'),  # Placeholder output, necessary for callback
     Output('iframe-video', 'src'),  # Add this output to update the iframe src
-    Input('output-graph', 'clickData')
+    Input('output-graph', 'clickData'),
+    State('store-data', 'data')
 )
-def open_url(clickData):
-    if clickData:
-        url = clickData['points'][0]['customdata']
+@timedStage
+def open_url(clickData, stored_data):
+    if clickData and stored_data:
+        # the traces do not carry a url per bin, it is made from the clicked bin start
+        seconds = int(round(clickData['points'][0]['x'] * 60))
+        columns = timestampUrls(stored_data.get('url'), [seconds])
+        if columns is None:
+            return "No video link for " + str(stored_data.get('url')), ""
+        url = columns[1][0]
         embed_url = ""
 
         if "youtube" in url:
@@ -389,7 +2477,7 @@ def open_url(clickData):
             timestamp = int(url.split("t=")[-1])
             embed_url = f"https://www.youtube-nocookie.com/embed/{vid_id}?autoplay=1&start={timestamp}&rel=0&vq=hd1080"
         elif "youtu.be" in url:
-            vid_id = url.split("/")[-1]
+            vid_id = url.split("/")[-1].split("?")[0]
             timestamp = int(url.split("t=")[-1])
             embed_url = f"https://www.youtube-nocookie.com/embed/{vid_id}?autoplay=1&start={timestamp}&rel=0&vq=hd1080"
         elif "twitch" in url:
@@ -406,92 +2494,393 @@ def open_url(clickData):
     return "Click on a bar to open the URL.", ""
 
 
-@dasher.callback(
-    Output('store-data', 'data'),
+@callback(
+    Output('store-job', 'data'),
+    Output('fetch-interval', 'disabled'),
+    Output('fetch-progress', 'children'),
     Input('fetch-button', 'n_clicks'),
     State('input-url', 'value'),
+    State('input-refresh', 'value'),
     prevent_initial_call=True
 )
-def fetch_and_store_data(n_clicks, url):
+@timedStage
+def fetch_and_store_data(n_clicks, url, refresh):
+    # the download runs in a worker thread, poll_fetch stores the dataset once it is done
     print("fetch")
     if url:
-        df = loadChat_fromURL(url)
-        data_json = df.to_json(date_format='iso', orient='split')
-        return {'url': url, 'data': data_json}
-    return dash.no_update
+        job_id = FETCH_JOBS.submit(url, refresh=bool(refresh))
+        return {'job': job_id}, False, "queued"
+    return dash.no_update, dash.no_update, dash.no_update
 
-@dasher.callback(
-    [Output('output-graph', 'figure'), Output('table-div', 'children', allow_duplicate=True)],
+@callback(
+    Output('store-data', 'data'),
+    Output('fetch-interval', 'disabled', allow_duplicate=True),
+    Output('fetch-progress', 'children', allow_duplicate=True),
+    Input('fetch-interval', 'n_intervals'),
+    State('store-job', 'data'),
+    prevent_initial_call=True
+)
+@timedStage
+def poll_fetch(n_intervals, job_data):
+    job = FETCH_JOBS.get(job_data['job']) if job_data else None
+    if job is None:
+        return dash.no_update, True, ""
+
+    if job.status == 'done':
+        return {'url': job.url, 'handle': job.handle}, True, job.describe()
+    if job.status in ('cancelled', 'error'):
+        return dash.no_update, True, job.describe()
+
+    # show the chat downloaded so far, read from the checkpoint of the download every PARTIAL_PREVIEW_SECONDS
+    key = cacheKey(job.url)
+    if job.status == 'running' and key is not None and time.monotonic() - job.preview_time >= PARTIAL_PREVIEW_SECONDS:
+        job.preview_time = time.monotonic()
+        messages = PartialChat(key).messages()
+        if messages > job.preview_messages:
+            dataset = partialDataset(job.url)
+            if dataset is not None:
+                job.preview_messages = messages
+                return {'url': job.url, 'handle': dataset.handle, 'partial': messages}, False, job.describe() + ", showing the first " + f"{len(dataset.df):,}"
+    return dash.no_update, False, job.describe()
+
+@callback(
+    Output('store-data', 'data', allow_duplicate=True),
+    Output('live-interval', 'disabled'),
+    Output('live-cursor', 'data'),
+    Output('fetch-progress', 'children', allow_duplicate=True),
+    Input('live-button', 'n_clicks'),
+    State('input-url', 'value'),
+    State('store-data', 'data'),
+    prevent_initial_call=True
+)
+@timedStage
+def toggle_live(n_clicks, url, stored_data):
+    # start tailing the stream, or stop it if this session is already live
+    if stored_data and stored_data.get('live'):
+        handle = LIVE_CHATS.stop(stored_data['handle'])
+        if handle is None:
+            return None, True, None, "live stopped"
+        return {'url': stored_data['url'], 'handle': handle}, True, None, "live stopped, chat saved"
+
+    if not url:
+        return dash.no_update, True, None, "enter a stream URL"
+    live = LIVE_CHATS.start(url)
+    return {'url': url, 'handle': live.handle, 'live': True}, False, None, live.describe()
+
+@callback(
+    Output('output-graph', 'figure', allow_duplicate=True),
+    Output('output-graph', 'extendData'),
+    Output('live-cursor', 'data', allow_duplicate=True),
+    Output('fetch-progress', 'children', allow_duplicate=True),
+    Input('live-interval', 'n_intervals'),
+    State('store-data', 'data'),
+    State('live-cursor', 'data'),
+    State('input-keyword', 'value'),
+    prevent_initial_call=True
+)
+@timedStage
+def update_live(n_intervals, stored_data, cursor, keyword):
+    # push only the bins completed since the last update, the whole figure is only sent
+    # on the first update and when the keyword changes
+    live = LIVE_CHATS.get(stored_data['handle']) if stored_data and stored_data.get('live') else None
+    if live is None:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+    keyword = keyword or None
+    try:
+        if cursor is None or cursor.get('keyword') != keyword:
+            fig, sent = liveFigure(live, keyword)
+            return fig, dash.no_update, {'bin': sent, 'keyword': keyword}, live.describe()
+
+        bins, chat, keyword_counts = live.bins(keyword, cursor['bin'])
+    except QueryError as e:
+        return dash.no_update, dash.no_update, dash.no_update, live.describe() + ", " + str(e)
+    if len(bins) == 0:
+        return dash.no_update, dash.no_update, dash.no_update, live.describe()
+
+    traces = liveTraces(live, bins, chat, keyword_counts)
+    extend = {'x': [list(t.x) for t in traces], 'y': [list(t.y) for t in traces]}
+    cursor = {'bin': cursor['bin'] + len(bins), 'keyword': keyword}
+    return dash.no_update, (extend, [0, 1, 2]), cursor, live.describe()
+
+@callback(
+    Output('fetch-progress', 'children', allow_duplicate=True),
+    Input('cancel-button', 'n_clicks'),
+    State('store-job', 'data'),
+    prevent_initial_call=True
+)
+@timedStage
+def cancel_fetch(n_clicks, job_data):
+    job = FETCH_JOBS.cancel(job_data['job']) if job_data else None
+    if job is None:
+        return "nothing to cancel"
+    return "cancelling, " + job.describe()
+
+@callback(
+    [Output('output-graph', 'figure'), Output('table-query', 'data', allow_duplicate=True), Output('figure-state', 'data')],
     Input('submit-button', 'n_clicks'),
     Input('store-data', 'data'),
+    Input('input-bin-width', 'value'),
+    Input('input-smooth', 'value'),
+    Input('input-split', 'value'),
+    Input('input-render', 'value'),
     [State('input-url', 'value'),
      State('input-keyword', 'value'),
      State('input-user', 'value'),
      State('input-start-time', 'value'),
-     State('input-end-time', 'value')],
+     State('input-end-time', 'value'),
+     State('figure-state', 'data'),
+     State('graph-width', 'data')],
     prevent_initial_call=True
 )
-def update_output(n_clicks, stored_data, url, keyword, user, start_time, end_time):
-    if stored_data:
+@timedStage
+def update_output(n_clicks, stored_data, bin_width, smooth, split, render, url, keyword, user, start_time, end_time, figure_state, pixels):
+    # an invalid query draws an empty graph titled with the error and empties the table
+    try:
+        return drawOutput(stored_data, bin_width, smooth, split, render, keyword, user, start_time, end_time, figure_state, pixels)
+    except QueryError as e:
+        fig = go.Figure()
+        fig.update_layout(title_text=str(e))
+        return fig, None, None
+
+def drawOutput(stored_data, bin_width, smooth, split, render, keyword, user, start_time, end_time, figure_state, pixels):
+    dataset = getDataset(stored_data)
+    if dataset:
         print("process")
-        urlo = stored_data['url']
-        data_json = stored_data['data']
-        dfo = pd.read_json(data_json, orient='split')
-
-        title = webScraping(urlo)
-
-        filtered_df2 = filter_data(dfo, start_time, end_time, None, None)
-        df2 = filtered_df2.groupby("time")["time"].count().reset_index(name="chat_per_minute")
-        df2['timestamp'] = df2['time'].astype(float)*60
-        df2 = addUrlToChat(urlo, df2)
-        # df2['url'] = df2['url'].apply(lambda x: f"[Link]({x})")
-
-
-        filtered_df3 = dfo
-        if keyword is not None and len(keyword) > 0:
-            filtered_df3 = filter_data(dfo, start_time, end_time, keyword, user)
-            df3 = filtered_df3.groupby("time")["keywordFound"].count().reset_index(name="keyword_per_minute")
-        else:
-            df3 = pd.DataFrame(columns=['time', 'keyword_per_minute'])
-
-        # merge df3['keyword_per_minute'] colum and df2['chat_per_minute'] colum in an df['activity'] colum using time as the key
-        df = pd.merge(df2, df3, on="time", how="outer")
-        df['keyword_per_minute'] = df['keyword_per_minute'].fillna(0)
-        df['chat_per_minute'] = df['chat_per_minute'].fillna(0)
-        df['activity'] = df['keyword_per_minute'] + df['chat_per_minute']
-
-
-        trace0 = go.Bar(x=df['time'], y=df['activity'], name='Combined Activity', marker_color='red')
-        trace1 = go.Bar(x=df2['time'], y=df2['chat_per_minute'], name='Chat Activity', marker_color='green', customdata=df2['url'], hovertemplate="<b>Time:</b> %{x}<br><b>Chats Per Minute:</b> %{y}<br><b>URL:</b> %{customdata}<extra></extra>")
-        trace2 = go.Bar(x=df3['time'], y=df3['keyword_per_minute'], name='Keyword Activity', marker_color='blue')
-
-        fig = go.Figure(data=[trace0, trace1, trace2])
+        urlo = dataset.url
+        dfo = dataset.df
+
+        title = dataset.title
+
+        # chat and keyword activity come from the precomputed pyramids, start/end are in minutes
+        start_s = int(start_time) * 60 if start_time else 0
+        end_s = (int(end_time) + 1) * 60 if end_time else dataset.pyramid.duration
+        options = {'width': bin_width, 'smooth': smooth, 'split': bool(split), 'render': render}
+        live = bool(stored_data.get('live'))
+        table_query = {'url': urlo, 'handle': dataset.handle, 'live': live, 'start_s': start_s, 'end_s': end_s, 'keyword': keyword, 'user': user}
+
+        # in live mode the figure is owned by update_live, which extends it as the stream goes
+        if live:
+            return dash.no_update, table_query, {'handle': dataset.handle, 'keyword': keyword, 'user': user, 'options': options}
+
+        # a Run on the figure already drawn only changes the keyword, patch the traces depending on it
+        # (at the view and resolution drawn) instead of sending the whole figure again
+        drawn = figure_state or {}
+        if (dash.callback_context.triggered_id == 'submit-button' and drawn.get('handle') == dataset.handle
+                and drawn.get('range') == [start_s, end_s] and drawn.get('options') == options and drawn.get('view')):
+            view = drawn['view']
+            width, traces = activityTraces(dataset, keyword, user, view[0], view[1], bin_width, smooth, bool(split), render, drawn.get('pixels'))
+            fig = dash.Patch()
+            patchTrace(fig, 0, traces[0])
+            patchTrace(fig, 2, traces[2])
+            fig['data'][2]['visible'] = traces[2].visible if traces[2].visible is not None else True
+            for i in range(3, drawn.get('traces', 3)):
+                del fig['data'][3]
+            if len(traces) > 3:
+                fig['data'].extend([t.to_plotly_json() for t in traces[3:]])
+            return fig, table_query, dict(drawn, keyword=keyword, user=user, traces=len(traces))
+
+        pixels = pixels or RENDER_PIXELS
+        width, traces = activityTraces(dataset, keyword, user, start_s, end_s, bin_width, smooth, bool(split), render, pixels)
+
+        fig = go.Figure(data=traces)
         fig.update_layout(
             barmode='overlay',  # Ensure histograms overlap
             title_text=title,
             xaxis_title_text='Time (minutes)',
             yaxis_title_text='Count',
+            uirevision=dataset.handle,
         )
 
-        table = None
-        if filtered_df3 is not None:
-            filtered_df3 = addUrlToChat(urlo, filtered_df3)
+        figure_state = {'handle': dataset.handle, 'range': [start_s, end_s], 'view': [start_s, end_s], 'pixels': pixels,
+                        'keyword': keyword, 'user': user, 'options': options, 'traces': len(traces)}
+        return fig, table_query, figure_state
+    return go.Figure(), None, None
 
-            filtered_df3['url'] = filtered_df3['url'].apply(lambda x: f"[Link]({x})")
-            filtered_df3 = filtered_df3[['time', 'timestamps', 'message', 'url']]
+TOP_CHATTERS = 10
+TOP_CHATTERS_COLUMNS = ['user', 'messages', 'share', 'first', 'last']
 
-            table = dash_table.DataTable(
-                data=filtered_df3.to_dict('records'),
-                columns=[{"name": i, "id": i, 'type': 'text', 'presentation': 'markdown'} if i == 'url' else {"name": i, "id": i} for i in filtered_df3.columns],
-                style_table={'overflowX': 'auto'},
-                style_cell={'textAlign': 'left'},
-                markdown_options={"html": True, "link_target": "_blank"}
-            )
-        return fig, table
-    return go.Figure()
+@callback(
+    Output('top-chatters', 'data'),
+    Input('table-query', 'data'),
+    prevent_initial_call=True
+)
+@timedStage
+def update_top_chatters(table_query):
+    # most active users of the graph selection, counted from the user index without reading the messages
+    dataset = getDataset(table_query)
+    if dataset is None or table_query.get('start_s') is None:
+        return []
+    total, top = dataset.topChatters(table_query['start_s'], table_query['end_s'], TOP_CHATTERS)
+    if len(top) == 0:
+        return []
+    first = formatTimestamps([t[2] for t in top])[0]
+    last = formatTimestamps([t[3] for t in top])[0]
+    return [{'user': name, 'messages': count, 'share': f"{count / total:.1%}", 'first': first[i], 'last': last[i]}
+            for i, (name, count, f, l) in enumerate(top)]
+
+TABLE_COLUMNS = ['time', 'timestamps', 'message', 'url']
+TABLE_SORT_COLUMNS = {'time': 'timestamp', 'timestamps': 'timestamp', 'url': 'timestamp', 'message': 'message'}
+TABLE_FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+def split_filter_part(filter_part: str):
+    # "{message} contains lol" -> ('message', 'contains', 'lol'), from the dash DataTable filtering examples
+    for operator_type in TABLE_FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+def parseTimestamp(value):
+    # "1:02:03" / "62:03" / 3723 -> seconds
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+@timedStage
+def filterTable(df, filter_query: str):
+    # apply the DataTable filter row to the filtered chat, time is in minutes and timestamps in H:MM:SS
+    if not filter_query:
+        return df
+    for filter_part in filter_query.split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name is None:
+            continue
+
+        if col_name == 'message':
+            if operator in ('contains', 'eq', 'datestartswith'):
+                df = df[df['message'].str.contains(str(value), case=False, regex=False, na=False)]
+            elif operator == 'ne':
+                df = df[~df['message'].str.contains(str(value), case=False, regex=False, na=False)]
+            continue
+
+        if col_name == 'time':
+            column, value = df['time'], float(value)
+        elif col_name in ('timestamps', 'url'):
+            column, value = df['timestamp'], parseTimestamp(value)
+        else:
+            continue
+
+        if operator in ('eq', 'contains', 'datestartswith'):
+            df = df[column == value]
+        elif operator == 'ne':
+            df = df[column != value]
+        elif operator == 'ge':
+            df = df[column >= value]
+        elif operator == 'le':
+            df = df[column <= value]
+        elif operator == 'gt':
+            df = df[column > value]
+        elif operator == 'lt':
+            df = df[column < value]
+    return df
+
+@timedStage
+def tableRows(dataset, table_query, sort_by, filter_query):
+    # the messages of the graph selection, with the table filters and sort applied
+    # memoized, turning the pages of the table or a second table-query for the same view is a cache hit
+    def compute():
+        df = filter_data(dataset.slice(table_query['start_s'], table_query['end_s']), None, None, table_query['keyword'], table_query['user'], dataset.index, dataset.users)
+        df = filterTable(df, filter_query)
+
+        if sort_by:
+            columns = [TABLE_SORT_COLUMNS.get(s['column_id'], 'timestamp') for s in sort_by]
+            df = df.sort_values(columns, ascending=[s['direction'] == 'asc' for s in sort_by], kind='stable')
+        return df
+
+    sort = tuple((s['column_id'], s['direction']) for s in sort_by or [])
+    params = (queryTime(table_query['start_s']), queryTime(table_query['end_s']), queryTerms(table_query['keyword']), queryUsers(table_query['user']),
+              (filter_query or '').strip(), sort)
+    return QUERY_CACHE.get(dataset, 'table', params, compute)
+
+@callback(
+    Output('chat-table', 'data'),
+    Output('chat-table', 'page_count'),
+    Output('chat-table', 'page_current'),
+    Output('table-info', 'children'),
+    Input('table-query', 'data'),
+    Input('chat-table', 'page_current'),
+    Input('chat-table', 'page_size'),
+    Input('chat-table', 'sort_by'),
+    Input('chat-table', 'filter_query'),
+    prevent_initial_call=True
+)
+@timedStage
+def update_table(table_query, page_current, page_size, sort_by, filter_query):
+    # server side paging, only the visible page gets its timestamps and urls
+    dataset = getDataset(table_query)
+    if dataset is None:
+        return [], 0, 0, ""
+
+    try:
+        df = tableRows(dataset, table_query, sort_by, filter_query)
+    except QueryError as e:
+        return [], 0, 0, str(e)
+
+    # a new query, filter or sort starts back on the first page, and the page never goes past the last one
+    page_count = max(int(np.ceil(len(df) / page_size)), 1)
+    if page_current is None or dash.callback_context.triggered_prop_ids.keys() & {'table-query.data', 'chat-table.filter_query', 'chat-table.sort_by'}:
+        page_current = 0
+    page_current = min(page_current, page_count - 1)
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+    page = addUrlToChat(dataset.url, page)
+    if page is None:
+        return [], 0, 0, ""
+    page['url'] = "[Link](" + page['url'] + ")"
+
+    return page[TABLE_COLUMNS].to_dict('records'), page_count, page_current, str(len(df)) + " messages"
+
+@callback(
+    Output('download-edl', 'data'),
+    Input('export-edl-button', 'n_clicks'),
+    State('table-query', 'data'),
+    State('chat-table', 'sort_by'),
+    State('chat-table', 'filter_query'),
+    prevent_initial_call=True
+)
+@timedStage
+def export_edl(n_clicks, table_query, sort_by, filter_query):
+    # the same messages as the table, streamed into one EDL string
+    dataset = getDataset(table_query)
+    if dataset is None:
+        return dash.no_update
+
+    try:
+        df = tableRows(dataset, table_query, sort_by, filter_query)
+    except QueryError:
+        return dash.no_update
+
+    f = io.StringIO()
+    writeEDL(f, chatMarkers(df, 'Yellow'))
+    return dcc.send_string(f.getvalue(), dataset.handle + ".edl")
 
 @app.command(rich_help_panel="Commands", help="Chat Activity Analyzer, if Keywords or Users are provided, it will filter the data.")
-def serve():
+def serve(
+                    profile_dir: Annotated[str, typer.Option(rich_help_panel="Debug Options", help="Dump a cProfile .prof file of every callback request to this directory (or set CHAD_PROFILE_DIR)")] = None,
+                    profile_callback: Annotated[List[str], typer.Option(rich_help_panel="Debug Options", help="Only profile this callback, e.g. update_output (can be used multiple times)")] = None,
+                ):
+    global PROFILE_DIR
+    if profile_dir:
+        PROFILE_DIR = profile_dir
+    PROFILE_CALLBACKS.update(profile_callback or [])
+
+    dasher = dashboard()
 
     dasher.layout = html.Div([
         html.Script(src="https://www.youtube.com/iframe_api"),
@@ -501,12 +2890,29 @@ def serve():
 
             dcc.Input(id='input-url', type='text', placeholder='Enter URL'),
             html.Button('Fetch Data', id='fetch-button', n_clicks=0),
+            html.Button('Cancel', id='cancel-button', n_clicks=0),
+            html.Button('Live', id='live-button', n_clicks=0),
+            dcc.Checklist(id='input-refresh', options=[{'label': 'Refresh cache', 'value': 'refresh'}], value=[], inline=True, style={'display': 'inline-block'}),
+            html.Span(id='fetch-progress', style={'marginLeft': '10px'}),
+            dcc.Store(id='store-job'),
+            dcc.Interval(id='fetch-interval', interval=1000, disabled=True),
+            dcc.Interval(id='live-interval', interval=LIVE_INTERVAL_MS, disabled=True),
+            dcc.Store(id='live-cursor'),
             html.Br(),
             dcc.Input(id='input-keyword', type='text', placeholder='Enter keyword'),
             dcc.Input(id='input-user', type='text', placeholder='Enter user'),
             dcc.Input(id='input-start-time', type='text', placeholder='Start Time'),
             dcc.Input(id='input-end-time', type='text', placeholder='End Time'),
             html.Button('Run', id='submit-button', n_clicks=0),
+            html.Br(),
+            dcc.Dropdown(id='input-bin-width', options=[{'label': 'Auto bins', 'value': 0}] + [{'label': binLabel(w) + ' bins', 'value': w} for w in BIN_WIDTHS],
+                         value=0, clearable=False, style={'width': '140px', 'display': 'inline-block', 'verticalAlign': 'middle'}),
+            dcc.Input(id='input-smooth', type='number', min=1, step=1, placeholder='Smooth (bins)'),
+            dcc.Checklist(id='input-split', options=[{'label': 'Split keywords', 'value': 'split'}], value=[], inline=True, style={'display': 'inline-block'}),
+            dcc.RadioItems(id='input-render', options=[{'label': 'Bars', 'value': 'bars'}, {'label': 'WebGL lines', 'value': 'webgl'}],
+                           value='bars', inline=True, style={'display': 'inline-block', 'marginLeft': '10px'}),
+            dcc.Store(id='figure-state'),
+            dcc.Store(id='graph-width'),
         ]),
         dcc.Graph(id='output-graph'),
         html.Div(id='url-output'),
@@ -514,7 +2920,37 @@ def serve():
             html.Iframe(id='iframe-video', style={'width': '45%', 'height': '390px', 'display': 'inline-block'}, allow="autoplay; fullscreen"),
             html.Textarea(id='note-area', style={'width': '45%', 'height': '390px', 'display': 'inline-block', 'resize': 'none'}, placeholder='Enter your notes here...'),
         ],  style={'textAlign': 'center'}),
-        html.Div(id='table-div'),
+        dcc.Store(id='table-query'),
+        html.Div([
+            html.Div([
+                html.Span(id='table-info'),
+                html.Button('Export EDL', id='export-edl-button', n_clicks=0, style={'marginLeft': '10px'}),
+                dcc.Download(id='download-edl'),
+            ]),
+            html.Details([
+                html.Summary('Top chatters'),
+                dash_table.DataTable(
+                    id='top-chatters',
+                    columns=[{"name": i, "id": i} for i in TOP_CHATTERS_COLUMNS],
+                    style_cell={'textAlign': 'left'},
+                ),
+            ]),
+            dash_table.DataTable(
+                id='chat-table',
+                columns=[{"name": i, "id": i, 'type': 'text', 'presentation': 'markdown'} if i == 'url' else {"name": i, "id": i} for i in TABLE_COLUMNS],
+                page_current=0,
+                page_size=50,
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[],
+                filter_action='custom',
+                filter_query='',
+                style_table={'overflowX': 'auto'},
+                style_cell={'textAlign': 'left'},
+                markdown_options={"html": True, "link_target": "_blank"}
+            ),
+        ], id='table-div'),
 
         # garbage at the bottom
         html.Div(id='zoom-level-info')
@@ -694,17 +3130,392 @@ def serve():
 
 # ------------------------  ------------------------  ------------------------
 
-@app.command(rich_help_panel="Commands", help="Command used to convert a vodts file to a DaVinci Resolve EDL file.")
-def vodts2edl(       path: str = typer.Argument(help="URL of the stream"),
-                    save_edl: str = typer.Argument(help="URL of the stream"),
+def inputFiles(path: str, pattern: str):
+    # a file, every file matching pattern in a directory, or a glob
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, pattern)))
+    if glob.has_magic(path):
+        return sorted(p for p in glob.glob(path) if os.path.isfile(p))
+    return [path]
 
-                    save_csv: Annotated[str, typer.Option(rich_help_panel="Chat Options", help="Save the markers to a csv file")] = None,
-                ):
-    
+def vodtsConvert(path: str, save_edl: str, save_csv: str):
     df = load_vodts_marker(path)
     saveMarker_toDaVinciEDL(df, save_edl)
-    df.to_csv(save_csv, index=False)
+    if save_csv:
+        df.to_csv(save_csv, index=False)
+    return len(df)
+
+def vodtsResults(todo, workers: int):
+    # (file, markers or the exception) for every (vodts, edl, csv) to convert
+    # parsing holds the GIL, so several workers means several processes, threads would only take turns
+    if workers <= 1:
+        for file, edl, csv in todo:
+            try:
+                yield file, vodtsConvert(file, edl, csv)
+            except Exception as e:
+                yield file, e
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(vodtsConvert, file, edl, csv): file for file, edl, csv in todo}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+@app.command(rich_help_panel="Commands", help="Command used to convert a vodts file to a DaVinci Resolve EDL file, or a directory/glob of vodts files to a directory of EDL files.")
+def vodts2edl(       path: str = typer.Argument(help="vodts file, directory or glob (quote it)"),
+                    save_edl: str = typer.Argument(help="EDL file, or output directory when converting several files"),
+
+                    save_csv: Annotated[str, typer.Option(rich_help_panel="Chat Options", help="Save the markers to a csv file (a directory when converting several files)")] = None,
+                    pattern: Annotated[str, typer.Option(rich_help_panel="Chat Options", help="Files to convert when path is a directory")] = "*.vodts",
+                    workers: Annotated[int, typer.Option(rich_help_panel="Chat Options", help="Number of processes converting files at the same time, 1 converts them one by one")] = os.cpu_count() or 1,
+                ):
+
+    if not (os.path.isdir(path) or glob.has_magic(path)):
+        vodtsConvert(path, save_edl, save_csv)
+        return;
+
+    # batch, every file keeps its name with the .edl/.csv extension
+    files = inputFiles(path, pattern)
+    os.makedirs(save_edl, exist_ok=True)
+    if save_csv:
+        os.makedirs(save_csv, exist_ok=True)
+
+    todo = []
+    for file in files:
+        name = os.path.splitext(os.path.basename(file))[0]
+        csv = os.path.join(save_csv, name + ".csv") if save_csv else None
+        todo.append((file, os.path.join(save_edl, name + ".edl"), csv))
+
+    t0 = time.perf_counter()
+    markers = 0
+    failed = []
+    for file, result in vodtsResults(todo, min(workers, len(todo))):
+        if isinstance(result, Exception):
+            failed.append(file)
+            print(file + " failed: " + str(result))
+        else:
+            markers += result
+
+    print(str(len(files) - len(failed)) + " files, " + f"{markers:,}" + " markers in " + f"{time.perf_counter() - t0:.1f}" + "s")
+    if failed:
+        raise typer.Exit(code=1)
+    return;
+
+# ------------------------  ------------------------  ------------------------
+
+def checkKeywords(keywords):
+    # an invalid keyword query is reported as a bad option before any file or download is started
+    try:
+        for keyword in keywords or []:
+            keywordMatcher(keyword)
+    except QueryError as e:
+        raise typer.BadParameter(str(e), param_hint="--keyword")
+
+def checkUser(user):
+    # same for the user query
+    try:
+        if user:
+            userQuery(user)
+    except QueryError as e:
+        raise typer.BadParameter(str(e), param_hint="--user")
+
+def activitySummary(df, keywords, index=None, width: int = 60, smooth: int = 0, split: bool = False):
+    # chat count and one count column per keyword query for every bin of width seconds,
+    # split adds a column per keyword of the queries with several keywords
+    pyramid = ActivityPyramid(df['timestamp'].to_numpy())
+    width, bins, chat = pyramid.query(0, pyramid.duration, width)
+    summary = pd.DataFrame({'time': bins // 60 if width % 60 == 0 else bins / 60, 'chat': smoothCounts(chat, smooth), 'timestamps': formatTimestamps(bins)[0]})
+    for keyword in keywords or []:
+        found = filter_data(df, None, None, keyword, None, index)
+        terms, codes = keywordCodes(keyword, found['keywordFound'].to_numpy())
+        counts = ActivityPyramid(found['timestamp'].to_numpy(), pyramid.duration, codes, terms).query(0, pyramid.duration, width, per_key=True)[2]
+        summary[keyword] = smoothCounts(counts.sum(axis=0), smooth)
+        if split and terms is not None and len(terms) > 1:
+            for term, row in zip(terms, counts):
+                summary[keyword + ": " + term] = smoothCounts(row, smooth)
+    return summary
+
+def batchOne(url: str, output_dir: str, keywords, refresh: bool, width: int = 60, smooth: int = 0, split: bool = False):
+    # download/cache one VOD and write its summary, the summary is written last so it marks the VOD as done
+    key = cacheKey(url)
+    df = loadChat_cached(url, refresh=refresh)
+    index = cacheReadIndex(key, len(df)) if key is not None else None
+    summary = activitySummary(df, keywords, index, width, smooth, split)
+
+    path = os.path.join(output_dir, key + ".activity.csv")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write('# TITLE: ' + str(df.attrs.get('title')) + '\n')
+        f.write('# URL: ' + url + '\n')
+        summary.to_csv(f, index=False, float_format="%.6g")
+    os.replace(tmp, path)
+    return len(df)
+
+@app.command(rich_help_panel="Commands", help="Download and summarise many VODs in parallel, VODs already summarised in the output directory are skipped.")
+def batch(
+                    urls: Annotated[List[str], typer.Argument(help="URLs of the VODs")] = None,
+                    file: Annotated[str, typer.Option(rich_help_panel="Input Options", help="File with one URL per line, # for comments")] = None,
+                    keyword: Annotated[List[str], typer.Option(rich_help_panel="Filter Options", help="Keyword query to count per bin (can be used multiple times)")] = None,
+                    bin_width: Annotated[int, typer.Option(rich_help_panel="Output Options", help="Bin width in seconds")] = 60,
+                    smooth: Annotated[int, typer.Option(rich_help_panel="Output Options", help="Moving average over this many bins")] = 0,
+                    split: Annotated[bool, typer.Option(rich_help_panel="Output Options", help="Also count every keyword of a query on its own")] = False,
+                    output_dir: Annotated[str, typer.Option(rich_help_panel="Output Options", help="Directory for the per VOD activity summaries")] = "chad_batch",
+                    workers: Annotated[int, typer.Option(rich_help_panel="Output Options", help="Number of VODs downloaded at the same time")] = 4,
+                    refresh: Annotated[bool, typer.Option(rich_help_panel="Input Options", help="Download the chats again even if they are cached")] = False,
+                ):
+
+    checkKeywords(keyword)
+    urls = list(urls or [])
+    if file:
+        with open(file, 'r') as f:
+            urls += [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+    # resumable, the VODs with a summary are skipped
+    os.makedirs(output_dir, exist_ok=True)
+    todo = []
+    for url in dict.fromkeys(urls):
+        key = cacheKey(url)
+        if key is None:
+            print("skipped " + url + ", not a youtube/twitch video url")
+        elif os.path.exists(os.path.join(output_dir, key + ".activity.csv")) and not refresh:
+            print("skipped " + key + ", already done")
+        else:
+            todo.append(url)
+
+    t0 = time.perf_counter()
+    total = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="chad-batch") as executor:
+        futures = {executor.submit(batchOne, url, output_dir, keyword, refresh, bin_width, smooth, split): url for url in todo}
+        for i, future in enumerate(as_completed(futures)):
+            url = futures[future]
+            try:
+                count = future.result()
+                total += count
+                print("[" + str(i + 1) + "/" + str(len(todo)) + "] " + cacheKey(url) + ", " + f"{count:,}" + " messages")
+            except Exception as e:
+                failed.append(url)
+                print("[" + str(i + 1) + "/" + str(len(todo)) + "] " + cacheKey(url) + " failed: " + str(e))
+
+    elapsed = time.perf_counter() - t0
+    print(str(len(todo) - len(failed)) + " VODs, " + f"{total:,}" + " messages in " + f"{elapsed:.1f}" + "s (" + f"{total / elapsed if elapsed > 0 else 0:.0f}" + " msg/s)")
+    if failed:
+        print("failed, run the command again to retry:")
+        for url in failed:
+            print("  " + url)
+        raise typer.Exit(code=1)
+    return;
+
+# ------------------------  ------------------------  ------------------------
+
+ANALYZE_COLUMNS = ['time', 'timestamp', 'user', 'message']
+ANALYZE_CHUNK_SIZE = 200000
+
+def csvComments(path: str, size: int = 4096):
+    # ({key: value} of the '# KEY: value' lines, number of comment lines at the top) of an exported csv,
+    # the title and url are written at the top or at the end, only those ends of the file are read
+    with open(path, 'rb') as f:
+        head = f.read(size)
+        f.seek(max(os.path.getsize(path) - size, 0))
+        tail = f.read(size)
+
+    head_lines = head.decode('utf-8', errors='replace').splitlines()
+    skip = 0
+    while skip < len(head_lines) and head_lines[skip].startswith('#'):
+        skip += 1
+
+    comments = {}
+    for line in head_lines[:skip] + tail.decode('utf-8', errors='replace').splitlines():
+        if line.startswith('# ') and ': ' in line:
+            name, value = line[2:].split(': ', 1)
+            comments.setdefault(name.strip().lower(), value.strip())
+    return comments, skip
+
+def readChatChunks(path: str, chunk_size: int = ANALYZE_CHUNK_SIZE):
+    # the chat of an exported csv in DataFrames of chunk_size rows
+    # comment='#' would cut the messages containing a #, the comment lines at the end are dropped as rows without a time
+    comments, skip = csvComments(path)
+    for chunk in pd.read_csv(path, skiprows=skip, usecols=lambda c: c in ANALYZE_COLUMNS, dtype={'user': object, 'message': object},
+                             chunksize=chunk_size, engine='c'):
+        time_column = pd.to_numeric(chunk['time'], errors='coerce')
+        if time_column.isna().any():
+            chunk = chunk[time_column.notna()]
+            time_column = time_column[time_column.notna()]
+        chunk = chunk.assign(time=time_column.to_numpy().astype(np.int64), user=chunk['user'].fillna(''), message=chunk['message'].fillna(''))
+        if 'timestamp' in chunk:
+            chunk['timestamp'] = pd.to_numeric(chunk['timestamp'], errors='coerce').fillna(0).to_numpy().astype(np.int64)
+        yield chunk
+
+def addCounts(counts, minutes):
+    # add one to the count of every minute in minutes
+    minutes = np.asarray(minutes, dtype=np.int64)
+    minutes = minutes[minutes >= 0]
+    if len(minutes) == 0:
+        return counts
+    size = int(minutes.max()) + 1
+    counts = growCounts(counts, size)
+    counts[:size] += np.bincount(minutes, minlength=size)
+    return counts
+
+def analyzeFile(path: str, output_dir: str, keywords, user: str, start: str, end: str, chunk_size: int, matches: bool):
+    # per minute counts and matching rows of one csv, read chunk_size rows at a time so the memory
+    # does not depend on the size of the file, returns (messages, matches per query)
+    name = os.path.splitext(os.path.basename(path))[0]
+    comments, skip = csvComments(path)
+
+    # one count per keyword query, or a single one for the user filter alone
+    queries = list(keywords or [])
+    if not queries and user:
+        queries = [None]
+    labels = [q if q is not None else "user " + user for q in queries]
+
+    chat = np.zeros(0, dtype=np.int64)
+    counts = [np.zeros(0, dtype=np.int64) for q in queries]
+    found_total = [0] * len(queries)
+    messages = 0
+
+    matches_path = os.path.join(output_dir, name + ".matches.csv")
+    tmp = matches_path + ".tmp"
+    out = open(tmp, 'w') if matches and queries else None
+    header = True
+    try:
+        for chunk in readChatChunks(path, chunk_size):
+            base = filter_data(chunk, start, end, None, None)
+            messages += len(base)
+            chat = addCounts(chat, base['time'].to_numpy())
+            for q, keyword in enumerate(queries):
+                found = filter_data(base, None, None, keyword, user)
+                counts[q] = addCounts(counts[q], found['time'].to_numpy())
+                found_total[q] += len(found)
+                if out is not None and len(found) > 0:
+                    if len(queries) > 1:
+                        found = found.assign(query=labels[q])
+                    found.to_csv(out, header=header, index=False)
+                    header = False
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(tmp)
+        raise
+    if out is not None:
+        out.close()
+        os.replace(tmp, matches_path)
+
+    # the count arrays grow by doubling, the summary stops at the last minute with a message
+    nonzero = np.flatnonzero(chat)
+    minutes = int(nonzero[-1]) + 1 if len(nonzero) > 0 else 0
+    time_column = np.arange(minutes, dtype=np.int64)
+    summary = pd.DataFrame({'time': time_column, 'chat': growCounts(chat, minutes)[:minutes], 'timestamps': formatTimestamps(time_column * 60)[0]})
+    for label, c in zip(labels, counts):
+        summary[label] = growCounts(c, minutes)[:minutes]
+
+    summary_path = os.path.join(output_dir, name + ".activity.csv")
+    with open(summary_path + ".tmp", "w") as f:
+        f.write('# TITLE: ' + str(comments.get('title')) + '\n')
+        f.write('# URL: ' + str(comments.get('url')) + '\n')
+        summary.to_csv(f, index=False)
+    os.replace(summary_path + ".tmp", summary_path)
+    return messages, dict(zip(labels, found_total))
+
+def analyzeResults(files, workers: int, *args):
+    # (file, (messages, matches) or the exception) for every csv analyzed with analyzeFile(file, *args)
+    # reading the csv and scanning the messages hold the GIL, so several workers means several processes
+    if workers <= 1:
+        for file in files:
+            try:
+                yield file, analyzeFile(file, *args)
+            except Exception as e:
+                yield file, e
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyzeFile, file, *args): file for file in files}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+@app.command(rich_help_panel="Commands", help="Count the chat and keyword activity per minute of exported chat csv files, read in chunks so files larger than the memory work.")
+def analyze(
+                    paths: Annotated[List[str], typer.Argument(help="csv files, directories or globs (quote them)")],
+                    keyword: Annotated[List[str], typer.Option(rich_help_panel="Filter Options", help="Keyword query to count per minute (can be used multiple times)")] = None,
+                    user: Annotated[str, typer.Option(rich_help_panel="Filter Options", help="Only count the messages of these users, names separated by , or | (case insensitive full names), re:<regex> for a pattern matching the whole name")] = None,
+                    start_time: Annotated[str, typer.Option(rich_help_panel="Filter Options", help="Start time in minutes")] = None,
+                    end_time: Annotated[str, typer.Option(rich_help_panel="Filter Options", help="End time in minutes")] = None,
+                    pattern: Annotated[str, typer.Option(rich_help_panel="Input Options", help="Files to read when a path is a directory")] = "*.csv",
+                    chunk_size: Annotated[int, typer.Option(rich_help_panel="Input Options", help="Rows read at a time, the memory used grows with it")] = ANALYZE_CHUNK_SIZE,
+                    output_dir: Annotated[str, typer.Option(rich_help_panel="Output Options", help="Directory for the per file activity (and matches) csv")] = "chad_analyze",
+                    matches: Annotated[bool, typer.Option(rich_help_panel="Output Options", help="Also write the matching messages of every file")] = True,
+                    workers: Annotated[int, typer.Option(rich_help_panel="Output Options", help="Number of processes reading files at the same time, 1 reads them one by one")] = 1,
+                ):
+
+    checkKeywords(keyword)
+    checkUser(user)
+    files = list(dict.fromkeys(f for path in paths for f in inputFiles(path, pattern)))
+    os.makedirs(output_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    rows = []
+    failed = []
+    for file, result in analyzeResults(files, min(workers, len(files)), output_dir, keyword, user, start_time, end_time, max(chunk_size, 1), matches):
+        if isinstance(result, Exception):
+            failed.append(file)
+            print(file + " failed: " + str(result))
+            continue
+        messages, found = result
+        rows.append([os.path.basename(file), f"{messages:,}"] + [f"{n:,}" for n in found.values()])
+
+    elapsed = time.perf_counter() - t0
+    labels = list(keyword or []) or (["user " + user] if user else [])
+    rows.sort()
+    print(tabulate(rows, headers=['file', 'messages'] + labels, tablefmt='simple', stralign='left'))
+    total = sum(int(r[1].replace(',', '')) for r in rows)
+    print(str(len(rows)) + " files, " + f"{total:,}" + " messages in " + f"{elapsed:.1f}" + "s (" + f"{total / elapsed if elapsed > 0 else 0:.0f}" + " msg/s)")
+    if failed:
+        raise typer.Exit(code=1)
+    return;
+
+# ------------------------  ------------------------  ------------------------
+
+cache_app = typer.Typer(add_completion=False, pretty_exceptions_enable=False, help="Manage the local chat cache (" + CACHE_DIR + ").")
+app.add_typer(cache_app, name="cache", rich_help_panel="Commands", help="List and prune the local chat cache.")
+
+@cache_app.command("list", help="List the cached chats and unfinished downloads (<key>.partial), least recently used first.")
+def cache_list():
+    entries = cacheEntries()
+    rows = []
+    for e in entries:
+        rows.append([e['key'], f"{e['size'] / 1024 / 1024:.1f} MB", datetime.datetime.fromtimestamp(e['used']).strftime("%Y-%m-%d %H:%M")])
+    print(tabulate(rows, headers=['key', 'size', 'last used'], tablefmt='plain', stralign='left', numalign='left'))
+    print(str(len(entries)) + " entries, " + f"{sum(e['size'] for e in entries) / 1024 / 1024:.1f}" + " MB / " + f"{CACHE_MAX_MB:.0f}" + " MB")
+    return;
+
+@cache_app.command("prune", help="Remove cached chats, by key, all of them, or the least recently used until the cache fits in --max-mb.")
+def cache_prune(
+                    keys: Annotated[List[str], typer.Argument(help="Cache keys to remove (see cache list)")] = None,
+                    all: Annotated[bool, typer.Option("--all", help="Remove every cached chat")] = False,
+                    max_mb: Annotated[float, typer.Option(help="Size limit in MB, default is CHAD_CACHE_MAX_MB")] = None,
+                ):
+
+    if all:
+        keys = [e['key'] for e in cacheEntries()]
+
+    removed = []
+    if keys:
+        for key in keys:
+            if cacheRemove(key):
+                removed.append(key)
+            else:
+                print("kept " + key + ", it is being downloaded")
+    else:
+        removed = cacheEvict(max_mb)
 
+    for key in removed:
+        print("removed " + key)
     return;
 
 # ------------------------  ------------------------  ------------------------
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+
+# pip install -r requirements.txt
+# python src/chad_bench.py run --sizes 10k,100k,1m
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import platform
+import datetime
+import subprocess
+import statistics
+
+import typer
+from typing import List
+from typing_extensions import Annotated
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from tabulate import tabulate
+
+import chad
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Benchmarks of the chad pipeline on synthetic chats, no network access needed
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+__BENCH_BRIEF__ = "Time every stage of " + chad.__SOFT_NAME__ + " on deterministic synthetic chats of growing size."
+
+app = typer.Typer(add_completion=False, pretty_exceptions_enable=False, help=__BENCH_BRIEF__)
+
+BENCH_URL = "https://www.youtube.com/watch?v=synthetic"
+BENCH_KEYWORD = "lol, kekw, pog*"           # words and a prefix, answered from the token index
+BENCH_SCAN_KEYWORD = "lol, kekw, pog*, :)"  # the literal forces a scan of the messages
+BENCH_T0 = 1_700_000_000_000_000            # UNIX microseconds of the first message
+
+EMOTES = ['lol', 'lmao', 'KEKW', 'LUL', 'PogChamp', 'Pog', 'pog', 'gg', 'GG', 'OMEGALUL', 'monkaS', 'Kappa', 'xD',
+          ':)', ':(', '<3', 'W', 'L', 'F', '?', '!!!', 'Clap', 'catJAM', 'Sadge', 'Copium', 'hello', 'hi', 'nice', 'wow', 'omg']
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Synthetic chat generator and stand-in for chat_downloader
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+def parseSize(size: str):
+    # 10k, 1m, 2.5M, 10000
+    size = size.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(size[-1:], 1)
+    return int(float(size.rstrip('km')) * scale)
+
+def burstProfile(profile: str, duration: int, rng):
+    # relative chat intensity for every second of the stream
+    #   flat     constant rate
+    #   bursty   slow rise and fall over the stream with a burst of 3-10x every ~10 minutes
+    #   spiky    quiet chat with short 20x spikes every ~5 minutes (raids, clutch plays)
+    t = np.arange(duration, dtype=np.float64)
+    if profile == 'flat':
+        return np.ones(duration)
+
+    if profile == 'bursty':
+        intensity = 1.0 + 0.5 * np.sin(np.pi * t / max(duration, 1))
+        for start in rng.integers(0, duration, max(duration // 600, 1)):
+            length = int(rng.integers(20, 180))
+            intensity[start:start + length] *= rng.uniform(3, 10)
+        return intensity
+
+    if profile == 'spiky':
+        intensity = np.full(duration, 0.5)
+        for start in rng.integers(0, duration, max(duration // 300, 1)):
+            intensity[start:start + int(rng.integers(5, 15))] *= 20
+        return intensity
+
+    raise typer.BadParameter("unknown profile " + profile + ", use flat, bursty or spiky")
+
+class SyntheticChat:
+    # deterministic chat of a given size, same seed and parameters give the same messages
+    # users follow a power law (a few chatters write most of the messages) and so do the words
+
+    def __init__(self, messages: int, rate: float = 50.0, profile: str = 'bursty', users: int = 5000, vocabulary: int = 500, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.duration = max(int(np.ceil(messages / rate)), 1)
+        self.title = "Synthetic chat (" + f"{messages:,}" + " messages, " + profile + ")"
+
+        # spread the messages over the seconds following the burst profile
+        intensity = burstProfile(profile, self.duration, rng)
+        per_second = rng.multinomial(messages, intensity / intensity.sum())
+        self.seconds = np.sort(np.repeat(np.arange(self.duration), per_second) + rng.random(messages))
+
+        weights = 1.0 / np.arange(1, users + 1) ** 1.1
+        names = np.array(['user' + str(i) for i in range(users)], dtype=object)
+        self.users = names[rng.choice(users, messages, p=weights / weights.sum())]
+
+        # emotes first so they are the most frequent words, then generated words
+        words = np.array((EMOTES + ['w' + str(i) for i in range(vocabulary)])[:max(vocabulary, 1)], dtype=object)
+        weights = 1.0 / np.arange(1, len(words) + 1)
+        lengths = rng.integers(1, 9, messages)
+        tokens = words[rng.choice(len(words), int(lengths.sum()), p=weights / weights.sum())] + " "
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self.messages = pd.Series(np.add.reduceat(tokens, offsets) if messages > 0 else tokens, dtype=object).str.rstrip().to_numpy()
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def chat(self, start_time=None, end_time=None):
+        # chat_downloader style messages between start_time and end_time (seconds), both included like chat_downloader
+        i0 = 0 if start_time is None else int(np.searchsorted(self.seconds, start_time, side='left'))
+        i1 = len(self.seconds) if end_time is None else int(np.searchsorted(self.seconds, end_time, side='right'))
+        for i in range(i0, i1):
+            s = float(self.seconds[i])
+            yield {'time_in_seconds': s, 'timestamp': BENCH_T0 + int(s * 1000000), 'author': {'name': self.users[i]}, 'message': self.messages[i]}
+
+FAKE_PAGE = 100     # messages per request of the fake chat source
+
+class FakeChat:
+    # what ChatDownloader.get_chat returns, an iterable of messages with title and duration
+    # latency is slept every page, overlap extends the range on both sides like a replay seeking to the page
+    # around start_time, fail_at raises a ConnectionError after that many messages
+
+    def __init__(self, synthetic: SyntheticChat, start_time=None, end_time=None, latency: float = 0, overlap: float = 0, fail_at: int = None):
+        self.synthetic = synthetic
+        self.title = synthetic.title
+        self.duration = synthetic.duration
+        self.start_time = start_time if start_time is None else max(start_time - overlap, 0)
+        self.end_time = end_time if end_time is None else end_time + overlap
+        self.latency = latency
+        self.fail_at = fail_at
+
+    def __iter__(self):
+        if not self.latency and self.fail_at is None:
+            return self.synthetic.chat(self.start_time, self.end_time)
+        return self.pages()
+
+    def pages(self):
+        for i, message in enumerate(self.synthetic.chat(self.start_time, self.end_time)):
+            if i == self.fail_at:
+                raise ConnectionError("fake chat source dropped the connection")
+            if self.latency and i % FAKE_PAGE == 0:
+                time.sleep(self.latency)
+            yield message
+
+class FakeChatDownloader:
+    # local stand-in for chat_downloader.ChatDownloader, every url returns the same synthetic chat
+    # the first failures requests for a time range break half way through
+
+    def __init__(self, synthetic: SyntheticChat, latency: float = 0, overlap: float = 0, failures: int = 0):
+        self.synthetic = synthetic
+        self.latency = latency
+        self.overlap = overlap
+        self.failures = failures
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def get_chat(self, url: str, start_time=None, end_time=None, **kwargs):
+        fail_at = None
+        if start_time is not None:
+            with self.lock:
+                if self.failed < self.failures:
+                    self.failed += 1
+                    fail_at = FAKE_PAGE * 5
+        return FakeChat(self.synthetic, start_time, end_time, self.latency, self.overlap, fail_at)
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Stages, each one gets the state of the previous ones and adds its own results
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+def stage_generate(state):
+    # iterating the stand-in alone, the part of ingest that is not chad's
+    for message in FakeChat(state['synthetic']):
+        pass
+
+def stage_ingest(state):
+    state['df'] = chad.loadChat_fromURL(BENCH_URL)
+
+def stage_cache_write(state):
+    chad.cacheWrite(chad.cacheKey(BENCH_URL), BENCH_URL, state['df'])
+
+def stage_cache_read(state):
+    state['df'] = chad.cacheRead(chad.cacheKey(BENCH_URL))
+
+def stage_index_build(state):
+    chad.TokenIndex.build(state['df']['message'].to_numpy())
+
+def stage_dataset(state):
+    state['dataset'] = chad.ChatDataset(chad.cacheKey(BENCH_URL), BENCH_URL, state['df'])
+
+def stage_filter_keyword(state):
+    state['filtered'] = chad.filter_data(state['df'], None, None, BENCH_KEYWORD, None, state['dataset'].index)
+
+def stage_filter_scan(state):
+    chad.filter_data(state['df'], None, None, BENCH_SCAN_KEYWORD, None)
+
+def stage_filter_user(state):
+    chad.filter_data(state['df'], None, None, None, "user0|user1|user2")
+
+def stage_groupby_time(state):
+    # per minute chat and keyword counts
+    state['df'].groupby("time")["time"].count()
+    state['filtered'].groupby("time")["keywordFound"].count()
+
+def stage_add_url(state):
+    chad.addUrlToChat(BENCH_URL, state['filtered'].copy())
+
+def stage_edl(state):
+    chad.saveChat_toDaVinciEDL(state['filtered'], os.path.join(state['tmp'], "bench.edl"), "Yellow")
+
+def stage_figure(state):
+    # what update_output builds for the whole stream with a keyword
+    dataset = state['dataset']
+    width, traces = chad.activityTraces(dataset, BENCH_KEYWORD, None, 0, dataset.pyramid.duration)
+    go.Figure(data=traces).to_json()
+
+def stage_table(state):
+    # what update_table does for the first page of the whole stream
+    dataset = state['dataset']
+    table_query = {'start_s': 0, 'end_s': dataset.pyramid.duration, 'keyword': BENCH_KEYWORD, 'user': None}
+    df = chad.tableRows(dataset, table_query, [{'column_id': 'timestamps', 'direction': 'desc'}], "")
+    chad.addUrlToChat(BENCH_URL, df.iloc[:50])
+
+STAGES = [
+    ('generate', stage_generate),
+    ('ingest', stage_ingest),
+    ('cache write', stage_cache_write),
+    ('cache read', stage_cache_read),
+    ('index build', stage_index_build),
+    ('dataset', stage_dataset),
+    ('filter keyword', stage_filter_keyword),
+    ('filter scan', stage_filter_scan),
+    ('filter user', stage_filter_user),
+    ('groupby time', stage_groupby_time),
+    ('add url', stage_add_url),
+    ('edl', stage_edl),
+    ('figure', stage_figure),
+    ('table', stage_table),
+]
+
+def dropResults(state):
+    # forget the query results and keyword pyramids of the earlier runs, every run of a stage computes them again
+    with chad.QUERY_CACHE.lock:
+        chad.QUERY_CACHE.entries.clear()
+        chad.QUERY_CACHE.nbytes = 0
+    dataset = state.get('dataset')
+    if dataset is not None:
+        with dataset.lock:
+            dataset.keyword_pyramids.clear()
+            dataset.keyword_nbytes = 0
+
+def runStage(fn, state, memory: bool):
+    # wall time, then when memory is on the peak of python/numpy allocations of a second run
+    # (tracing slows the stage down several times, arrow buffers are not traced)
+    dropResults(state)
+    t0 = time.perf_counter()
+    fn(state)
+    elapsed = time.perf_counter() - t0
+    peak = None
+    if memory:
+        dropResults(state)
+        tracemalloc.start()
+        fn(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+def runSize(messages: int, rate: float, profile: str, users: int, vocabulary: int, seed: int, memory: bool, only):
+    synthetic = SyntheticChat(messages, rate, profile, users, vocabulary, seed)
+    state = {'synthetic': synthetic, 'tmp': tempfile.mkdtemp(prefix="chad_bench_")}
+
+    # every chad side effect stays in the temporary directory
+    chad.CACHE_DIR = state['tmp']
+    chad.ChatDownloader = FakeChatDownloader(synthetic)
+    chad.webScraping = lambda url: synthetic.title
+
+    results = []
+    try:
+        for name, fn in STAGES:
+            if only and name not in only and name not in ('ingest', 'dataset', 'filter keyword'):
+                continue
+            elapsed, peak = runStage(fn, state, memory)
+            results.append({'messages': messages, 'stage': name, 'seconds': elapsed, 'peak_mb': peak / 1024 / 1024 if peak is not None else None})
+            print(f"{messages:>10,} {name:<16} {elapsed:8.3f}s" + (f" {peak / 1024 / 1024:9.1f} MB" if peak is not None else ""), file=sys.stderr)
+    finally:
+        shutil.rmtree(state['tmp'], ignore_errors=True)
+    return results
+
+def compareResults(results, baseline, tolerance: float):
+    # stages slower than the baseline by more than tolerance, stages under 10 ms are too noisy to compare
+    base = {(r['messages'], r['stage']): r['seconds'] for r in baseline}
+    regressions = []
+    for r in results:
+        before = base.get((r['messages'], r['stage']))
+        if before is None or max(before, r['seconds']) < 0.01:
+            continue
+        if r['seconds'] > before * (1 + tolerance):
+            regressions.append([f"{r['messages']:,}", r['stage'], f"{before:.3f}", f"{r['seconds']:.3f}", f"{r['seconds'] / before - 1:+.0%}"])
+    return regressions
+
+# ------------------------  ------------------------  ------------------------
+# ------------ ------------------------  ------------------------ ------------
+# Commands
+# ------------ ------------------------  ------------------------ ------------
+# ------------------------  ------------------------  ------------------------
+
+@app.command(help="Run the benchmark at every size and print wall time, throughput and peak memory of each stage.")
+def run(
+                    sizes: Annotated[str, typer.Option(help="Comma separated chat sizes, 10k,100k,1m,10m")] = "10k,100k,1m",
+                    rate: Annotated[float, typer.Option(rich_help_panel="Generator Options", help="Average messages per second, sets the stream duration")] = 50.0,
+                    profile: Annotated[str, typer.Option(rich_help_panel="Generator Options", help="Burst profile: flat, bursty or spiky")] = "bursty",
+                    users: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Number of distinct chatters")] = 5000,
+                    vocabulary: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Number of distinct words and emotes")] = 500,
+                    seed: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Random seed, the same seed gives the same chats")] = 0,
+                    stage: Annotated[List[str], typer.Option(help="Only run these stages (ingest, dataset and filter keyword always run, later stages need them)")] = None,
+                    memory: Annotated[bool, typer.Option(help="Run every stage a second time to trace its peak memory")] = True,
+                    output: Annotated[str, typer.Option(rich_help_panel="Output Options", help="Save the results to a json file")] = None,
+                    compare: Annotated[str, typer.Option(rich_help_panel="Output Options", help="json file of a previous run, exit with an error if a stage got slower")] = None,
+                    tolerance: Annotated[float, typer.Option(rich_help_panel="Output Options", help="Allowed slowdown against --compare, 0.25 is 25%")] = 0.25,
+                ):
+
+    results = []
+    for size in sizes.split(','):
+        results += runSize(parseSize(size), rate, profile, users, vocabulary, seed, memory, stage)
+
+    rows = []
+    for r in results:
+        rows.append([f"{r['messages']:,}", r['stage'], f"{r['seconds']:.3f}", f"{r['messages'] / r['seconds']:,.0f}" if r['seconds'] > 0 else "",
+                     f"{r['peak_mb']:.1f}" if r['peak_mb'] is not None else ""])
+    print(tabulate(rows, headers=['messages', 'stage', 'seconds', 'msg/s', 'peak MB'], tablefmt='simple', stralign='left', numalign='right'))
+
+    if output:
+        run_info = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'version': chad.__SOFT_VERSION__,
+                    'python': platform.python_version(), 'machine': platform.machine(),
+                    'generator': {'rate': rate, 'profile': profile, 'users': users, 'vocabulary': vocabulary, 'seed': seed}}
+        with open(output, 'w') as f:
+            json.dump({'run': run_info, 'results': results}, f, indent=1)
+
+    if compare:
+        with open(compare, 'r') as f:
+            regressions = compareResults(results, json.load(f)['results'], tolerance)
+        if regressions:
+            print("")
+            print(tabulate(regressions, headers=['messages', 'stage', 'before', 'now', 'change'], tablefmt='simple', stralign='left'))
+            raise typer.Exit(code=1)
+        print("no stage slower than " + f"{tolerance:.0%}" + " against " + compare)
+    return;
+
+@app.command(help="Write a synthetic chat to a csv file in the chad format, to try the dashboard or the CLI without downloading.")
+def generate(
+                    path: str = typer.Argument(help="csv file to write"),
+                    size: Annotated[str, typer.Option(help="Number of messages, 10k, 1m, ...")] = "100k",
+                    rate: Annotated[float, typer.Option(rich_help_panel="Generator Options", help="Average messages per second")] = 50.0,
+                    profile: Annotated[str, typer.Option(rich_help_panel="Generator Options", help="Burst profile: flat, bursty or spiky")] = "bursty",
+                    users: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Number of distinct chatters")] = 5000,
+                    vocabulary: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Number of distinct words and emotes")] = 500,
+                    seed: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Random seed")] = 0,
+                ):
+
+    synthetic = SyntheticChat(parseSize(size), rate, profile, users, vocabulary, seed)
+    df = chad.ingestChat(FakeChat(synthetic))
+    chad.saveChat_toCSV(df, path)
+    return;
+
+@app.command(help="Download a fake chat with network latency serially and as parallel segments (with failing segments), check that both give the same chat.")
+def segments(
+                    size: Annotated[str, typer.Option(help="Number of messages, 10k, 1m, ...")] = "200k",
+                    segments: Annotated[int, typer.Option(help="Segments downloaded in parallel")] = 4,
+                    latency: Annotated[float, typer.Option(help="Milliseconds slept by the fake source every " + str(FAKE_PAGE) + " messages")] = 5.0,
+                    overlap: Annotated[float, typer.Option(help="Seconds of chat the fake source adds before and after every range")] = 5.0,
+                    failures: Annotated[int, typer.Option(help="Segment requests that drop the connection half way")] = 2,
+                    rate: Annotated[float, typer.Option(rich_help_panel="Generator Options", help="Average messages per second, sets the VOD duration")] = 10.0,
+                    profile: Annotated[str, typer.Option(rich_help_panel="Generator Options", help="Burst profile: flat, bursty or spiky")] = "bursty",
+                    seed: Annotated[int, typer.Option(rich_help_panel="Generator Options", help="Random seed")] = 0,
+                ):
+
+    synthetic = SyntheticChat(parseSize(size), rate, profile, seed=seed)
+    fake = FakeChatDownloader(synthetic, latency / 1000, overlap)
+    chad.ChatDownloader = fake
+    chad.FETCH_SEGMENT_BACKOFF = 0.1
+
+    t0 = time.perf_counter()
+    serial = chad.loadChat_fromURL(BENCH_URL, segments=1)
+    serial_s = time.perf_counter() - t0
+
+    fake.failures = failures
+    t0 = time.perf_counter()
+    segmented = chad.loadChat_fromURL(BENCH_URL, segments=segments)
+    segmented_s = time.perf_counter() - t0
+
+    same = serial.equals(segmented)
+    rows = [['serial', 1, f"{len(serial):,}", f"{serial_s:.2f}", ""],
+            ['segmented', len(chad.chatSegments(synthetic.duration, segments)), f"{len(segmented):,}", f"{segmented_s:.2f}", fake.failed]]
+    print(tabulate(rows, headers=['download', 'segments', 'messages', 'seconds', 'failed requests'], tablefmt='simple', stralign='left'))
+    print("segmented chat " + ("matches" if same else "DIFFERS from") + " the serial download")
+    if not same:
+        raise typer.Exit(code=1)
+    return;
+
+CHAD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chad.py")
+HEAVY_MODULES = ['dash', 'plotly', 'flask', 'requests', 'chat_downloader', 'tabulate']
+
+def startupCommands(tmp: str):
+    # commands that are scripted in loops and must not pay for the dashboard
+    vodts = os.path.join(tmp, "bench.vodts")
+    with open(vodts, 'w') as f:
+        f.write("header\nheader\nheader\n0:00:10 chapter\n0:01:00 . subchapter\n1:02:03 .... editor note\n")
+    return [
+        ('--version', ['--version']),
+        ('--help', ['--help']),
+        ('vodts2edl', ['vodts2edl', vodts, os.path.join(tmp, "bench.edl")]),
+        ('cache list', ['cache', 'list']),
+    ]
+
+@app.command(help="Time the startup of the CLI commands and check that importing chad does not load the dashboard dependencies.")
+def startup(
+                    repeat: Annotated[int, typer.Option(help="Runs of every command, the median is reported")] = 5,
+                    max_seconds: Annotated[float, typer.Option(help="Exit with an error if a command takes longer than this (median)")] = None,
+                ):
+
+    tmp = tempfile.mkdtemp(prefix="chad_bench_")
+    env = dict(os.environ, CHAD_CACHE_DIR=tmp)
+    try:
+        # modules loaded by a plain import
+        probe = "import sys, json; sys.path.insert(0, " + repr(os.path.dirname(CHAD_SCRIPT)) + "); import chad; print(json.dumps(sorted(set(m.split('.')[0] for m in sys.modules))))"
+        loaded = json.loads(subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True, check=True).stdout)
+        heavy = [m for m in HEAVY_MODULES if m in loaded]
+
+        rows = []
+        slow = []
+        for name, args in startupCommands(tmp):
+            times = []
+            for i in range(max(repeat, 1)):
+                t0 = time.perf_counter()
+                subprocess.run([sys.executable, CHAD_SCRIPT] + args, env=env, capture_output=True, check=True)
+                times.append(time.perf_counter() - t0)
+            median = statistics.median(times)
+            rows.append([name, f"{min(times):.3f}", f"{median:.3f}"])
+            if max_seconds is not None and median > max_seconds:
+                slow.append(name)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(tabulate(rows, headers=['command', 'min s', 'median s'], tablefmt='simple', stralign='left'))
+    print("dashboard modules loaded by import chad: " + (", ".join(heavy) if heavy else "none"))
+    if heavy or slow:
+        if slow:
+            print("slower than " + f"{max_seconds:.2f}" + "s: " + ", ".join(slow))
+        raise typer.Exit(code=1)
+    return;
+
+if __name__ == "__main__":
+    app()
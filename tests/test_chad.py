@@ -0,0 +1,181 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import numpy as np
+import pytest
+
+import chad
+
+
+def test_cache_key_videos():
+    assert chad.cacheKey("https://www.youtube.com/watch?v=yFG5AJ38p6U&t=10") == "youtube_yFG5AJ38p6U"
+    assert chad.cacheKey("https://youtu.be/yFG5AJ38p6U?t=2127") == "youtube_yFG5AJ38p6U"
+    assert chad.cacheKey("https://www.youtube.com/live/yFG5AJ38p6U?si=abc") == "youtube_yFG5AJ38p6U"
+    assert chad.cacheKey("https://www.twitch.tv/videos/2139118880?t=04h21m03s") == "twitch_2139118880"
+
+
+def test_cache_key_channels():
+    # channel urls show a different stream over time, they must not get a cache key
+    assert chad.cacheKey("https://www.youtube.com/@chanA/live") is None
+    assert chad.cacheKey("https://www.youtube.com/@chanB/live") is None
+    assert chad.cacheKey("https://www.youtube.com/channel/UC123/live") is None
+    assert chad.cacheKey("https://www.twitch.tv/somechannel") is None
+    assert chad.cacheKey("https://example.com/video") is None
+    assert chad.cacheKey(None) is None
+
+
+def test_token_index_none_messages():
+    index = chad.TokenIndex.build(["hi lol", None, "Lol lolw"])
+    assert index.tokens == ["hi", "lol", "lolw"]
+    assert list(index.word("lol")) == [0, 2]
+
+
+def test_keyword_whole_word():
+    # plain keywords match whole words, with or without the index
+    df = chad.chatFrame(np.array([0, 1000000, 2000000]), np.array(["a", "b", "c"], dtype=object),
+                        np.array(["lol", "lolw", None], dtype=object))
+    index = chad.TokenIndex.build(df["message"])
+    for keyword, expected in (("lol", 1), ("lol*", 2), ("re:lol", 2)):
+        assert len(chad.filter_data(df, None, None, keyword, None, index)) == expected
+        assert len(chad.filter_data(df, None, None, keyword, None)) == expected
+
+
+def test_title_failure_cached(tmp_path, monkeypatch):
+    # a failed lookup is not retried on every call, e.g. when the host is unreachable
+    calls = []
+    monkeypatch.setattr(chad, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(chad, "webScraping", lambda url: calls.append(url))
+    url = "https://youtu.be/notitle"
+    assert chad.getTitle(url) is None
+    assert chad.getTitle(url) is None
+    assert len(calls) == 1
+
+    chad.title_failures[chad.cacheKey(url)] -= chad.TITLE_RETRY_TTL
+    monkeypatch.setattr(chad, "webScraping", lambda url: calls.append(url) or "Title")
+    assert chad.getTitle(url) == "Title"
+    assert len(calls) == 2
+
+
+def test_live_handle_channels():
+    # two channels' /live urls are two live chats, the same channel written differently is one
+    a = chad.liveHandle("https://www.youtube.com/@chanA/live")
+    assert a != chad.liveHandle("https://www.youtube.com/@chanB/live")
+    assert a == chad.liveHandle("https://YouTube.com/@chanA/live/")
+    assert chad.liveHandle("https://youtu.be/yFG5AJ38p6U") == "live_youtube_yFG5AJ38p6U"
+
+
+def test_keyword_pyramids_counted():
+    # keyword pyramids are part of the dataset memory the registry limits, and bounded
+    n = 10000
+    df = chad.chatFrame(np.arange(n, dtype=np.int64) * 1000000, np.array(["u%d" % (i % 7) for i in range(n)], dtype=object),
+                        np.array(["w%d hello" % (i % 20) for i in range(n)], dtype=object))
+    dataset = chad.ChatDataset("test", "https://youtu.be/test", df, indexed=False)
+    base = dataset.nbytes
+    dataset.keywordPyramid("w1", None)
+    assert dataset.nbytes > base
+    for i in range(chad.KEYWORD_PYRAMIDS + 4):
+        dataset.keywordPyramid("w%d, hello" % i, None)
+    assert len(dataset.keyword_pyramids) == chad.KEYWORD_PYRAMIDS
+    assert dataset.nbytes == dataset.base_nbytes + sum(p.nbytes for p in dataset.keyword_pyramids.values())
+
+
+def test_partial_lock(tmp_path, monkeypatch):
+    # a second download of the same video waits, the lock file goes away with the lock
+    monkeypatch.setattr(chad, "CACHE_DIR", str(tmp_path))
+    with chad.partialLock("youtube_same") as locked:
+        assert locked
+        with chad.partialLock("youtube_same", blocking=False) as again:
+            assert not again
+        with chad.partialLock("youtube_other", blocking=False) as other:
+            assert other
+    assert not os.path.exists(chad.partialPath("youtube_same") + ".lock")
+    with chad.partialLock("youtube_same", blocking=False) as locked:
+        assert locked
+
+
+def test_partial_in_cache_entries(tmp_path, monkeypatch):
+    # unfinished downloads count in the cache size and are pruned, except while downloading
+    monkeypatch.setattr(chad, "CACHE_DIR", str(tmp_path))
+    os.makedirs(chad.partialPath("youtube_left"))
+    with open(os.path.join(chad.partialPath("youtube_left"), "00-00000.parquet"), "wb") as f:
+        f.write(b"x" * 1000)
+    entries = chad.cacheEntries()
+    assert [(e["key"], e["size"]) for e in entries] == [("youtube_left.partial", 1000)]
+
+    with chad.partialLock("youtube_left"):
+        assert chad.cacheEvict(0) == []
+    assert chad.cacheEvict(0) == ["youtube_left.partial"]
+    assert not os.path.exists(chad.partialPath("youtube_left"))
+
+
+def test_invalid_keyword_regex():
+    # an invalid re: term is a QueryError naming it, not a re.error from deep in a callback
+    with pytest.raises(chad.QueryError, match=r"re:\["):
+        chad.keywordMatcher("lol, re:[")
+    assert chad.keywordMatcher("lol, re:gg+") is not None
+
+
+def test_keyword_found_index_parity():
+    # the keyword reported for a message is the same with and without the token index
+    messages = np.array(["kekw pog", "pog kekw", "lol", "lolw lol", "trololo pogger", "pogger trol", "LOL :) gg", None, ":) lol"],
+                        dtype=object)
+    index = chad.TokenIndex.build(messages)
+    rows = np.arange(len(messages))
+    for query in ("pog, kekw", "kekw, pog", "lol, lol*", "lol*, lol", "pog*, re:trol", "re:trol, pog*", "gg, :), lol"):
+        matcher = chad.keywordMatcher(query)
+        mask, found = matcher.match(messages)
+        mask_indexed, found_indexed = matcher.match(messages, rows, index)
+        assert (mask == mask_indexed).all(), query
+        assert list(found[mask]) == list(found_indexed[mask_indexed]), query
+    mask, found = chad.keywordMatcher("pog, kekw").match(messages, rows, index)
+    assert found[0] == "kekw" and found[1] == "pog"
+
+
+def test_segmented_download(tmp_path, monkeypatch, capsys):
+    # the segments of a VOD merge to the serial download, retried when they fail and resumed from the checkpoint
+    import chad_bench
+    monkeypatch.setattr(chad, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(chad, "PROGRESS_EVERY", 100)
+    monkeypatch.setattr(chad, "PARTIAL_FLUSH_MESSAGES", 100)
+    monkeypatch.setattr(chad, "FETCH_SEGMENT_BACKOFF", 0.001)
+    synthetic = chad_bench.SyntheticChat(40000, 4)
+    # whole seconds so messages fall on the segment boundaries, fetched by both segments around them
+    synthetic.seconds = np.floor(synthetic.seconds)
+    fake = chad_bench.FakeChatDownloader(synthetic, overlap=5)
+    monkeypatch.setattr(chad, "ChatDownloader", fake)
+    ranges = chad.chatSegments(synthetic.duration, 4)
+    assert len(ranges) == 4
+    assert np.isin([start_s for start_s, end_s in ranges[1:]], synthetic.seconds).all()
+
+    serial = chad.loadChat_fromURL(chad_bench.BENCH_URL, segments=1)
+    assert len(serial) == len(synthetic)
+    assert chad.loadChat_fromURL(chad_bench.BENCH_URL, segments=4).equals(serial)
+
+    fake.failures = 1
+    assert chad.loadChat_fromURL(chad_bench.BENCH_URL, segments=4).equals(serial)
+    assert fake.failed == 1
+
+    key = chad.cacheKey(chad_bench.BENCH_URL)
+    fake.failures, fake.failed = 100, 0
+    with pytest.raises(ConnectionError):
+        chad.loadChat_cached(chad_bench.BENCH_URL)
+    written = chad.PartialChat(key).messages()
+    assert 0 < written < len(serial)
+    fake.failures = 0
+    capsys.readouterr()
+    df = chad.loadChat_cached(chad_bench.BENCH_URL)
+    assert "resuming " + key + " from " + f"{written:,}" in capsys.readouterr().out
+    assert df.equals(serial)
+    assert df.attrs["title"] == synthetic.title
+    assert not os.path.exists(chad.partialPath(key))
+
+
+def test_invalid_user_regex():
+    # same for the user query, the re: patterns still match whole names
+    with pytest.raises(chad.QueryError, match=r"re:\["):
+        chad.userQuery("someone, re:[")
+    df = chad.chatFrame(np.array([0, 1000000, 2000000]), np.array(["Bot1", "bot12x", "someone"], dtype=object),
+                        np.array(["a", "b", "c"], dtype=object))
+    assert list(chad.userMask(df, r"re:bot\d+")) == [True, False, False]